@@ -1,11 +1,17 @@
 import os
 from re import search, sub
 import stat
+import threading
 from langchain_core.tools import tool
-from langchain_core.messages import HumanMessage, AIMessage, ToolMessage
-from langchain_openai import ChatOpenAI
+from langchain_core.messages import HumanMessage, AIMessage, ToolMessage, message_chunk_to_message
 from dotenv import load_dotenv
-from reddit import get_relevant_subreddits, post_to_reddit, fetch_comments_for_query
+from reddit import (suggest_subreddits, queue_posts, get_post_status, fetch_comments_for_query,
+                    request_context, get_prefetch_stats)
+from tool_executor import MAX_TOOL_ROUNDS, execute_tool_calls
+from serialize import serialize_tool_result
+from presummarize import presummarize_posts
+from llm_cache import CachedChatModel
+from instrumentation import span
 
 load_dotenv()
 
@@ -13,29 +19,35 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 if not OPENAI_API_KEY:
     raise ValueError("No OpenAI API key found. Please check your .env file.")
 
-# Initialize the LLM
-llm = ChatOpenAI(model="gpt-4o-mini", api_key=OPENAI_API_KEY)
+_llm_with_tools = None
+_llm_lock = threading.Lock()
 
 
 @tool
 def grab_subreddits(keywords: list[str]) -> list:
-    """finds subreddits based on keywords"""
+    """finds the most relevant subreddits for keywords, ranked best first"""
     print("Grabbing subreddits for keywords: ", keywords)
-    subreddits = get_relevant_subreddits(keywords, search_limit=20)
+    subreddits = suggest_subreddits(keywords, search_limit=20)
     print("Found subreddits: ", subreddits)
-    # next step is to make an LLM call to filter this!
     return subreddits
 
 
 @tool
-def post_to_subreddit(subreddit: str, title: str, content: str) -> str:
-    """Posts to a subreddit."""
-    result = post_to_reddit(subreddit, title, content)
-    if result:
-        status = "success"
-    else:
-        status = "failure"
-    return {"status": status, "result": result}
+def post_to_subreddit(subreddits: list[str], title: str, content: str) -> list:
+    """
+    Posts one title and body to one or more subreddits.
+
+    Returns one job per subreddit once the posts are submitted (or after a short
+    wait); jobs that are still queued can be checked with check_post_status.
+    """
+    return queue_posts(subreddits, title, content)
+
+
+@tool
+def check_post_status(job_ids: list[str]) -> list:
+    """Returns the current status (and post URL once submitted) of post jobs."""
+    return get_post_status(job_ids)
+
 
 @tool
 def fetch_comments(subreddit: str, query: str, post_limit: int = 5, comment_limit: int = 5) -> list:
@@ -53,10 +65,91 @@ def fetch_comments(subreddit: str, query: str, post_limit: int = 5, comment_limi
     """
     print(f"Fetching comments for query '{query}' in r/{subreddit}...")
     results = fetch_comments_for_query(subreddit, query, post_limit, comment_limit)
-    return results
+    # Keep only the comment sentences most relevant to the query
+    return presummarize_posts(results, query)
+
+tools = [grab_subreddits, post_to_subreddit, check_post_status, fetch_comments]
+tools_by_name = {t.name: t for t in tools}
+
+
+def get_llm_with_tools():
+    """Return the tool-bound LLM, building it on first use."""
+    global _llm_with_tools
+    if _llm_with_tools is None:
+        with _llm_lock:
+            if _llm_with_tools is None:
+                # langchain_openai takes over a second to import, so it is only loaded when needed
+                from langchain_openai import ChatOpenAI
+                llm = ChatOpenAI(model="gpt-4o-mini", api_key=OPENAI_API_KEY, stream_usage=True)
+                # Identical prompts (repeat questions) are answered from the cache
+                _llm_with_tools = CachedChatModel(llm.bind_tools(tools))
+    return _llm_with_tools
+
+
+def stream_response(messages):
+    """Print the LLM's reply token by token and return the assembled message."""
+    response = None
+    started = False
+    for chunk in get_llm_with_tools().stream(messages):
+        response = chunk if response is None else response + chunk
+        if chunk.content:
+            if not started:
+                print("\nAI: ", end="", flush=True)
+                started = True
+            print(chunk.content, end="", flush=True)
+    if started:
+        print()
+    if response is None:
+        return AIMessage(content="")
+    return message_chunk_to_message(response)
+
+
+def run_turn(messages, question=None):
+    """
+    Answer the latest user message, running tools as the LLM asks for them.
+
+    Args:
+        messages (list): The conversation, ending with the user's message.
+            The LLM's replies and tool results are appended in place.
+        question (str): The user's opening question, which suggested subreddits
+            are prefetched for; defaults to the first user message.
+
+    Returns:
+        AIMessage: The LLM's last reply of the turn.
+    """
+    if question is None:
+        question = next((str(m.content) for m in messages if isinstance(m, HumanMessage)), None)
+    with span("turn", session="cli"), request_context(query=question):
+        # Stream the LLM's reply to the current messages
+        ai_response = stream_response(messages)
+
+        # Add the AI's response to messages
+        messages.append(ai_response)
+
+        # While the LLM asks for tools, run them and send all results back in one call
+        for _ in range(MAX_TOOL_ROUNDS):
+            if not ai_response.tool_calls:
+                break
+
+            # Run all tool calls of this round concurrently, results come back in call order
+            for result in execute_tool_calls(ai_response.tool_calls, tools_by_name, session="cli"):
+                # Add a ToolMessage for each call to messages
+                messages.append(ToolMessage(
+                    content=serialize_tool_result(result),
+                    tool_call_id=result.tool_call_id
+                ))
+
+            # Re-invoke the LLM with the updated messages (printed as it streams)
+            ai_response = stream_response(messages)
+            messages.append(ai_response)
 
-tools = [grab_subreddits, post_to_subreddit, fetch_comments]
-llm_with_tools = llm.bind_tools(tools)
+        # Every tool call needs an answer before the next request is valid
+        for tool_call in ai_response.tool_calls:
+            messages.append(ToolMessage(
+                content="Not run: tool call limit for this turn reached.",
+                tool_call_id=tool_call["id"]
+            ))
+        return ai_response
 
 
 def interactive_chat(initial_instructions: str = ""):
@@ -64,6 +157,9 @@ def interactive_chat(initial_instructions: str = ""):
     print("Type 'exit' to end the conversation")
 
     messages = []
+    question = None  # The user's opening question (the first message may be the instructions)
+    # Load the LLM while the user types the first message
+    threading.Thread(target=get_llm_with_tools, daemon=True).start()
 
     if initial_instructions.strip():
         messages.append(HumanMessage(content=initial_instructions.strip()))
@@ -74,55 +170,16 @@ def interactive_chat(initial_instructions: str = ""):
         user_input = input("You: ")
 
         if user_input.lower() == 'exit':
+            print(f"LLM cache: {get_llm_with_tools().stats()}")
+            print(f"Prefetch: {get_prefetch_stats()}")
             print("Goodbye!")
             break
 
         messages.append(HumanMessage(content=user_input))
+        question = question or user_input
 
         try:
-            # Invoke the LLM with the current messages
-            ai_response = llm_with_tools.invoke(messages)
-
-            # Add the AI's response to messages
-            messages.append(ai_response)
-
-            # Check if there are tool calls
-            if ai_response.tool_calls:
-                # Process each tool call
-                for tool_call in ai_response.tool_calls:
-                    tool_name = tool_call["name"]
-                    tool_args = tool_call["args"]
-                    tool_call_id = tool_call["id"]
-
-                    # Dynamically select and invoke the tool
-                    if tool_name == "grab_subreddits":
-                        tool_result = grab_subreddits.invoke(tool_args)
-                    elif tool_name == "post_to_subreddit":
-                        tool_result = post_to_subreddit.invoke(tool_args)
-                    else:
-                        print(f"Unknown tool: {tool_name}")
-                        continue
-
-                    # Create a ToolMessage
-                    tool_message = ToolMessage(
-                        content=str(tool_result),
-                        tool_call_id=tool_call_id
-                    )
-
-                    # Add the tool message to messages
-                    messages.append(tool_message)
-
-                # Re-invoke the LLM with the updated messages
-                final_response = llm_with_tools.invoke(messages)
-
-                # Print and add the final response
-                print("\nAI:", final_response.content)
-                messages.append(final_response)
-
-            else:
-                # If no tool calls, just print the AI's response
-                print("\nAI:", ai_response.content)
-
+            run_turn(messages, question=question)
         except Exception as e:
             print(f"\nError: {e}")
             # Print the full traceback for debugging
@@ -151,7 +208,7 @@ Clarification:
 Extracted Keywords: ["travel", "credit cards", "rewards"].
 MAKE SURE TO PASS THE EXRTRACTED KEYWORDS AS AN ARRAY LIKE ["travel", "credit cards", "rewards", "points"] to the grab_subreddits() function.
 Grab Subreddits: Call grab_subreddits(["travel", "credit cards", "rewards", "points", "cashback", "international travel", "foreign transaction fees", "business travel", "personal trips", "frequent flyer"]).
-Based on the returned subreddits, choose the top 5 that you think are most relevant to the query based on their descriptions.
+The returned subreddits are already the top 5 most relevant ones, ranked best first.
 Confirmation the subreddit:
 "I found these relevant subreddits: r/travel, r/creditcards, r/awardtravel. Would you like to dive deeper into one or more of these subreddits?"
 Brainstorm title and content for the post with the user.
@@ -161,6 +218,6 @@ Call the fetch_comments() tool to: search for the query within the subreddit, re
 Ask if the summary answered the user's question. If the user is happy with the summary, then they have their answer and no further steps are necessary. If not, then continuing to posting steps.
 
 Post to Subreddit: If the user agrees, post the query to the selected subreddit(s). 
-If the response from the function says like Post Submitted, then its a success! Let the user know.
+The post function returns one job per subreddit. If a job is submitted, then its a success! Let the user know and share the link. If it is still queued, tell the user it is being posted and check on it with check_post_status when asked.
 """
     interactive_chat(initial_instructions=instructions)
@@ -1,10 +1,18 @@
 import streamlit as st
 import os
+import uuid
 from dotenv import load_dotenv
 from langchain_core.tools import tool
-from langchain_core.messages import HumanMessage, ToolMessage, AIMessage
-from langchain_openai import ChatOpenAI
-from reddit import get_relevant_subreddits, post_to_reddit, fetch_comments_for_query
+from langchain_core.messages import HumanMessage, ToolMessage, AIMessage, SystemMessage, message_chunk_to_message
+from reddit import (suggest_subreddits, queue_posts, get_post_status, fetch_comments_for_query,
+                    iter_comments_for_query, request_context, get_scheduler_stats, get_prefetch_stats)
+from tool_executor import MAX_TOOL_ROUNDS, execute_tool_calls
+from context_budget import ContextBudget, count_tokens
+from serialize import serialize_tool_result
+from presummarize import presummarize_posts
+from llm_cache import CachedChatModel
+from instrumentation import span, last_trace_id, summarize_trace, render_prometheus
+from worker_pool import PoolBusy, get_worker_pool
 
 # Load environment variables (contains OPENAI_API_KEY)
 load_dotenv()
@@ -12,21 +20,29 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 if not OPENAI_API_KEY:
     raise ValueError("No OpenAI API key found. Please check your .env file.")
 
-# Initialize the LLM
-llm = ChatOpenAI(model="gpt-4o-mini", api_key=OPENAI_API_KEY)  
 
 @tool
 def grab_subreddits(keywords: list[str]) -> list:
-    """Finds subreddits based on keywords."""
-    return get_relevant_subreddits(keywords, search_limit=10)
+    """Finds the most relevant subreddits for keywords, ranked best first."""
+    return suggest_subreddits(keywords, search_limit=10)
 
 
 @tool
-def post_to_subreddit(subreddit: str, title: str, content: str) -> str:
-    """Posts to a subreddit."""
-    result = post_to_reddit(subreddit, title, content)
-    status = "success" if result else "failure"
-    return {"status": status, "result": result}
+def post_to_subreddit(subreddits: list[str], title: str, content: str) -> list:
+    """
+    Posts one title and body to one or more subreddits.
+
+    Returns one job per subreddit once the posts are submitted (or after a short
+    wait); jobs that are still queued can be checked with check_post_status.
+    """
+    return queue_posts(subreddits, title, content)
+
+
+@tool
+def check_post_status(job_ids: list[str]) -> list:
+    """Returns the current status (and post URL once submitted) of post jobs."""
+    return get_post_status(job_ids)
+
 
 @tool
 def fetch_comments(subreddit: str, query: str, post_limit: int = 5, comment_limit: int = 5) -> list:
@@ -44,15 +60,70 @@ def fetch_comments(subreddit: str, query: str, post_limit: int = 5, comment_limi
     """
     print(f"Fetching comments for query '{query}' in r/{subreddit}...")
     results = fetch_comments_for_query(subreddit, query, post_limit, comment_limit)
-    return results
+    # Keep only the comment sentences most relevant to the query
+    return presummarize_posts(results, query)
+
+tools = [grab_subreddits, post_to_subreddit, check_post_status, fetch_comments]
+tools_by_name = {t.name: t for t in tools}
+
+
+# Streamlit re-executes this script on every interaction; cached resources are
+# built once per process and shared by all sessions
+@st.cache_resource(show_spinner=False)
+def get_llm():
+    # langchain_openai takes over a second to import, so it is only loaded when needed
+    from langchain_openai import ChatOpenAI
+    return ChatOpenAI(model="gpt-4o-mini", api_key=OPENAI_API_KEY, stream_usage=True)
+
+
+@st.cache_resource(show_spinner=False)
+def get_llm_with_tools():
+    # Identical prompts (repeat questions, Streamlit reruns) are answered from the cache
+    return CachedChatModel(get_llm().bind_tools(tools))
+
+
+TOOL_RESULTS_PROMPT = """The tool results above are hidden from the user.
+If a result starts with "subreddits", it is a list of the most relevant subreddits, already ranked best first, please return them to the user in a friendly way.
+If a result starts with "posts", it is a list of posts and their comments, and please summarize the most relevant insights from the comments to address the user's question. Present the summary clearly.
+If a result starts with "post jobs", it lists one post per subreddit: say which posts were submitted and hyperlink their urls, which are still being posted in the background (the user can ask you to check on them), and which failed and why. Remember be friendly!"""
+
+SUMMARY_PROMPT = """Update the running summary of a conversation in which an assistant helps a user find relevant subreddits, summarize community answers and post questions.
+Keep the user's goal and preferences, approved keywords, suggested and chosen subreddits, key findings, any submitted post with its link, and the job ids of posts still being submitted. Be concise.
+
+Current summary:
+{digest}
+
+New messages:
+{messages}"""
+
+TOOL_SPINNER_TEXT = {
+    "grab_subreddits": "Searching for relevant subreddits...",
+    "post_to_subreddit": "Posting...",
+    "check_post_status": "Checking on the post...",
+    "fetch_comments": "Fetching top posts and comments...",
+}
+
+# Results kept in the chat history, so later turns still know the post job ids to check on
+REMEMBERED_TOOLS = {"post_to_subreddit", "check_post_status"}
+
+def summarize_messages(digest, messages):
+    """Fold older chat messages into the running conversation digest."""
+    transcript = "\n".join(f"{msg['role']}: {msg['content']}" for msg in messages)
+    prompt = SUMMARY_PROMPT.format(digest=digest or "(none yet)", messages=transcript)
+    job = get_worker_pool().submit(get_llm().invoke, [HumanMessage(content=prompt)],
+                                   session=st.session_state["session_id"])
+    return job.result().content
 
-tools = [grab_subreddits, post_to_subreddit, fetch_comments]
-llm_with_tools = llm.bind_tools(tools)
 
 def init_session_state():
     """Initialize session state variables, if not already present."""
+    if "session_id" not in st.session_state:
+        # Lets the shared Reddit request scheduler queue this session's requests fairly
+        st.session_state["session_id"] = uuid.uuid4().hex
     if "messages" not in st.session_state:
         st.session_state["messages"] = []
+    if "context_budget" not in st.session_state:
+        st.session_state["context_budget"] = ContextBudget(summarize_messages)
     if "system_prompt" not in st.session_state:
         # Store system instructions hidden from the UI
         st.session_state["system_prompt"] = """
@@ -69,7 +140,7 @@ Step 2: **Keyword Extraction**
 
 Step 3: **Find Relevant Subreddits**
 - Call the `grab_subreddits()` function with the approved keyword list.
-- Review the returned subreddits and select the top 5 most relevant ones based on their descriptions.
+- The returned subreddits are already the top 5, ranked by relevance (best first).
 - Present the selected subreddits to the user in a friendly manner:
     "I found these subreddits that might help: r/travel, r/creditcards, r/awardtravel. Would you like to explore one of these further?"
 
@@ -77,11 +148,7 @@ Step 4: **Analyze Subreddit Content**
 - Once the user chooses a subreddit, formulate a relevant query based on their original question and preferences.
 - Call the `fetch_comments()` function with the chosen subreddit and query to retrieve:
     - The top N posts (e.g., 5) and the top M comments per post (e.g., 5).
-    - Each posts's answers will be in a list and in the following format: {
-                "title": submission.title,
-                "url": submission.url,
-                "comments": top_comments (list)
-            }
+    - The result starts with "posts" and lists each post as a numbered "title | url" line followed by its comments, one per line starting with "- ".
 - Summarize the most relevant insights from the comments to address the user's question. Present the summary clearly:
     "Here’s what I found based on community insights: ..."
 - Ask the user if the summary answers their question:
@@ -95,7 +162,8 @@ Step 5: **Prepare to Post to Subreddit**
 - Confirm the final content with the user before proceeding.
 
 Step 6: **Post to Subreddit**
-- Call the `post_to_subreddit()` function with the chosen subreddit, title, and content.
+- Call the `post_to_subreddit()` function with the chosen subreddit(s), title, and content. Pass all chosen subreddits in one call.
+- Posts are usually submitted by the time it returns; if a job is still queued, use `check_post_status()` with its id (from the earlier "post jobs" result) when the user asks.
 - If the post is successful, confirm with the user and provide a direct link:
     "Your question has been successfully posted! Here's the link: [POST_URL]"
 
@@ -126,11 +194,25 @@ Ensure all responses are concise, clear, and user-friendly. Keep the user inform
 
 
 def convert_to_langchain_messages():
+    """
+    Build the LLM prompt: system prompt, digest of older turns, then recent messages.
+
+    The context budget keeps the verbatim history under a token budget by
+    summarizing the oldest turns, so the prompt stays roughly flat over long chats.
+    """
+    system_prompt = st.session_state["system_prompt"]
+    budget = st.session_state["context_budget"]
+    digest, recent_msgs = budget.fit(st.session_state["messages"],
+                                     fixed_tokens=count_tokens(system_prompt))
+
     langchain_msgs = [ 
-        AIMessage(role="system", content=st.session_state["system_prompt"])
+        AIMessage(role="system", content=system_prompt)
     ]
+    if digest:
+        langchain_msgs.append(
+            SystemMessage(content=f"Summary of the earlier conversation:\n{digest}"))
 
-    for msg in st.session_state["messages"]:
+    for msg in recent_msgs:
         if msg["role"] == "user":
             langchain_msgs.append(HumanMessage(content=msg["content"]))
         elif msg["role"] == "assistant":
@@ -149,54 +231,122 @@ def add_message(role: str, content: str, tool_call_id: str = None):
     st.session_state["messages"].append(message_data)
 
 
-def handle_tool_calls(ai_response):
-    """Process tool calls, reformat outputs, and display only the final result."""
+def stream_comments(tool_args):
+    """Run fetch_comments, showing each post as soon as it arrives, and return all posts."""
+    posts = []
+    status = st.status("Fetching top posts and comments...", expanded=True)
+    # Reddit is queried on the shared worker pool; this thread only draws the posts
+    for post in get_worker_pool().iterate(iter_comments_for_query, tool_args["subreddit"], tool_args["query"],
+                                          tool_args.get("post_limit", 5), tool_args.get("comment_limit", 5),
+                                          session=st.session_state["session_id"]):
+        posts.append(post)
+        with status:
+            st.markdown(f"**[{post['title']}]({post['url']})**")
+            for comment in post["comments"][:1]:
+                st.caption(comment[:300])
+    status.update(label=f"Fetched {len(posts)} posts from r/{tool_args['subreddit']}",
+                  state="complete", expanded=False)
+    return presummarize_posts(posts, tool_args["query"])
+
+
+def stream_llm_response(messages, placeholder):
+    """
+    Stream a completion into `placeholder` as tokens arrive.
+
+    Tool-call chunks are merged as they stream in, so the returned message has
+    complete `tool_calls` just like the result of `invoke`.
+    """
+    response = None
+    # The OpenAI call runs on the shared worker pool; this thread only draws the tokens
+    for chunk in get_worker_pool().iterate(get_llm_with_tools().stream, messages,
+                                           session=st.session_state["session_id"]):
+        response = chunk if response is None else response + chunk
+        if chunk.content:
+            placeholder.markdown(response.content + "▌")
+    if response is None:
+        return AIMessage(content="")
+    placeholder.markdown(response.content)
+    return message_chunk_to_message(response)
+
+
+def run_tools(tool_calls):
+    """Run one round of tool calls, concurrently when there are several.
+
+    A lone fetch_comments call runs on the script thread so its posts can be
+    streamed into the UI.
+    """
+    inline = {}
+    if len(tool_calls) == 1 and tool_calls[0]["name"] == "fetch_comments":
+        print(f"Reached: {tool_calls[0]['args']}")
+        inline["fetch_comments"] = stream_comments
+    spinner_text = " ".join(
+        TOOL_SPINNER_TEXT.get(tool_call["name"], "Running tools...") for tool_call in tool_calls)
+    with st.spinner(spinner_text):
+        return execute_tool_calls(tool_calls, tools_by_name, inline=inline,
+                                  session=st.session_state["session_id"])
+
+
+def handle_tool_calls(ai_response, placeholder=None, max_rounds=MAX_TOOL_ROUNDS):
+    """
+    Run the requested tools and stream the LLM's answer based on their results.
+
+    All tool results of a round go back to the LLM together, as ToolMessages tied
+    to their tool_call_id, in a single follow-up call. If that reply asks for
+    more tools the loop repeats, up to `max_rounds` rounds per user turn.
+    """
     final_response = ai_response
+    placeholder = placeholder or st.empty()
 
     if not ai_response.tool_calls:
         return final_response
 
-    for tool_call in ai_response.tool_calls:
-        tool_name = tool_call["name"]
-        tool_args = tool_call["args"]
-
-        # 1) Call the tool
-        result = None
-        if tool_name == "grab_subreddits":
-            with st.spinner("Searching for relevant subreddits..."):
-                result = grab_subreddits.invoke(tool_args)
-        elif tool_name == "post_to_subreddit":
-            with st.spinner("Posting to the subreddit..."):
-                result = post_to_subreddit.invoke(tool_args)
-        elif tool_name == "fetch_comments":
-            with st.spinner("Fetching top posts and comments..."):
-                print(f"Reached: {tool_args}")
-                result = fetch_comments.invoke(tool_args)
-        else:
-            result = f"Unknown tool: {tool_name}"
-
-        # 2) Inject the tool result back into the conversation (hidden from UI)
-        reformat_prompt = f"""Here is the raw output from the tool: {result}. DO NOT CALL A TOOL CALL AGAIN, IT HAS ALREADY BEEN CALLED.
-            If the output is in the form of [(subreddit name, rank), ...], this is a list of subreddits, please select the top 5 most relevant ones based on their descriptions and return them to the user in a friendly way. 
-            Otherwise if the output is in the form of [(title, url, comments)], this is a list of posts and comments, and please summarize the most relevant insights from the comments to address the user's question. Present the summary clearly:
-            Otherwise if the output is a url to a reddit post, say that the post was successfully submitted and hyperlink it. Remember be friendly!"""
-
-        print("REFORMAT PROMPT: ", reformat_prompt)
-        temp_msgs = convert_to_langchain_messages()
-        temp_msgs.append(HumanMessage(content=reformat_prompt))  # Hidden prompt for LLM
-
-        # 3) Invoke the LLM again to reformat the tool output
-        with st.spinner("Processing tool results..."):
-            final_response = llm_with_tools.invoke(temp_msgs)
-
-        # 4) Add only the reformatted response to the session state for display
-        formatted_content = final_response.content
+    turn_msgs = convert_to_langchain_messages()
+    for round_number in range(1, max_rounds + 1):
+        if not final_response.tool_calls:
+            break
+
+        # 1) Call the tools and add their results to this turn's history
+        turn_msgs.append(final_response)
+        for tool_result in run_tools(final_response.tool_calls):
+            content = serialize_tool_result(tool_result)
+            turn_msgs.append(ToolMessage(content=content, tool_call_id=tool_result.tool_call_id))
+            if tool_result.name in REMEMBERED_TOOLS:
+                add_message("tool", content, tool_result.tool_call_id)
+
+        # 2) Hidden instructions on how to present the results
+        reformat_prompt = TOOL_RESULTS_PROMPT
+        if round_number == max_rounds:
+            reformat_prompt += " DO NOT CALL ANY MORE TOOLS, answer with what you have."
+
+        # 3) One LLM call for all results of the round, streamed into the chat
+        final_response = stream_llm_response(
+            turn_msgs + [HumanMessage(content=reformat_prompt)], placeholder)
         print("FORMATTED CONTENT: ", final_response)
-        add_message("assistant", formatted_content)
 
     return final_response
 
 
+def render_diagnostics():
+    """Sidebar panel showing where the time of the last turn went, plus process-wide metrics."""
+    with st.sidebar.expander("Diagnostics"):
+        trace_id = last_trace_id("turn")
+        if trace_id is None:
+            st.caption("No turn recorded yet.")
+        else:
+            st.markdown("**Last turn**")
+            st.dataframe(summarize_trace(trace_id), use_container_width=True)
+        st.markdown("**Worker pool**")
+        st.json(get_worker_pool().stats())
+        st.markdown("**Reddit scheduler**")
+        st.json(get_scheduler_stats())
+        st.markdown("**Prefetch**")
+        st.json(get_prefetch_stats())
+        st.markdown("**LLM cache**")
+        st.json(get_llm_with_tools().stats())
+        st.markdown("**Metrics**")
+        st.code(render_prometheus(), language="text")
+
+
 def main():
     st.set_page_config(page_title="Subreddit AI Agent",
                        page_icon=None, layout="wide")
@@ -204,39 +354,56 @@ def main():
     init_session_state()
 
     for msg in st.session_state["messages"]:
+        if msg["role"] == "tool":
+            continue  # Hidden from the user, only the LLM sees tool results
         with st.chat_message(msg["role"]):
             st.markdown(msg["content"])
 
     user_input = st.chat_input("Ask me about subreddits or anything else...")
 
     if user_input:
-        # Immediately display user's new message at the bottom
-        with st.chat_message("user"):
-            st.markdown(user_input)
-        add_message("user", user_input)
-
-        # Prepare LLM call
-        langchain_msgs = convert_to_langchain_messages()
-
-        # Create a placeholder for the AI response, so the spinner is localized
-        ai_message_placeholder = st.chat_message("assistant")
-        with ai_message_placeholder:
-            with st.spinner("Thinking..."):
+        session_id = st.session_state["session_id"]
+        # The opening question, not later replies like "yes, looks good", is what posts get prefetched for
+        question = st.session_state.setdefault("question", user_input)
+        # Jobs of an interrupted earlier run of this session are no longer needed
+        get_worker_pool().cancel_session(session_id)
+        with span("turn", session=session_id) as turn_span, request_context(session=session_id, query=question):
+            # Immediately display user's new message at the bottom
+            with st.chat_message("user"):
+                st.markdown(user_input)
+            add_message("user", user_input)
+
+            # Prepare LLM call
+            langchain_msgs = convert_to_langchain_messages()
+            turn_span.set(context_tokens=st.session_state["context_budget"].last_prompt_tokens)
+
+            # Stream the AI response into a placeholder inside the assistant bubble
+            with st.chat_message("assistant"):
+                placeholder = st.empty()
                 try:
-                    ai_response = llm_with_tools.invoke(langchain_msgs)
+                    ai_response = stream_llm_response(langchain_msgs, placeholder)
+
+                    final_content = ai_response.content
+                    # If tools were called, handle them
+                    if ai_response.tool_calls:
+                        final_response = handle_tool_calls(ai_response, placeholder)
+                        final_content = final_response.content
+                except PoolBusy as e:
+                    turn_span.record_error(e)
+                    st.warning("Lots of people are using the assistant right now, please try again in a moment.")
+                    return
                 except Exception as e:
+                    turn_span.record_error(e)
                     st.error(f"LLM invocation error: {str(e)}")
                     return
 
-                final_content = ai_response.content
-                # If tools were called, handle them
-                if ai_response.tool_calls:
-                    final_response = handle_tool_calls(ai_response)
-                    final_content = final_response.content
-
-                # Now replace the spinner with the final AI message
+                # Now show the final AI message in place of the streamed text
                 add_message("assistant", final_content)
-                st.markdown(final_content)
+                placeholder.markdown(final_content)
+
+    render_diagnostics()
+    # The page is drawn by now; load the LLM (first run only) before the user's first message
+    get_llm_with_tools()
 
     # No final display_messages() call, because we manually printed messages above.
     # The entire conversation plus the new messages is visible now.
@@ -0,0 +1,275 @@
+"""
+Headless batch mode: answer many questions from Reddit without the chat UI.
+
+Reads questions from a JSONL file ({"query": ..., optional "id", "keywords" and
+"search_query"}) and runs keyword extraction -> subreddit discovery -> comment
+fetching -> LLM summary for each, several at a time. Posts are searched with a
+short query (like the one the chat LLM writes), not the whole question. Results are appended to a JSONL file as
+soon as each question is done; that file is also the checkpoint, so a rerun
+skips the questions already answered and retries the failed ones (a retried
+question then has several records; the last one counts).
+
+    python batch.py questions.jsonl -o answers.jsonl
+    python batch.py questions.jsonl -o answers.jsonl --concurrency 8 --subreddits 3
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from dotenv import load_dotenv
+from langchain_core.messages import HumanMessage
+
+from instrumentation import span
+from llm_cache import CachedChatModel
+from presummarize import presummarize_posts
+from reddit import fetch_comments_for_query, get_request_stats, request_context, suggest_subreddits
+from serialize import serialize_posts
+
+load_dotenv()
+
+
+### CONSTANTS ###
+BATCH_CONCURRENCY = 4  # Questions processed at once
+BATCH_SUBREDDITS = 2  # Best-ranked subreddits whose posts are read per question
+BATCH_SEARCH_LIMIT = 20  # Subreddits searched per keyword during discovery
+BATCH_POST_LIMIT = 5  # Posts read per subreddit
+BATCH_COMMENT_LIMIT = 5  # Top comments read per post
+KEYWORD_COUNT = 8  # Keywords the LLM is asked to extract from a question
+SEARCH_QUERY_WORDS = 4  # Words in a post-search query derived from keywords; Reddit matches all of them
+
+KEYWORD_PROMPT = (
+    "Extract up to {count} short search keywords for finding Reddit communities about this question, "
+    "and a short Reddit search query (2-4 words) for finding posts that answer it. "
+    'Answer with JSON only, like {{"keywords": ["travel", "credit cards"], "search_query": "travel credit card"}}.'
+    "\n\nQuestion: {query}"
+)
+SUMMARY_PROMPT = (
+    "Using only the Reddit posts and comments below, answer the question in a short paragraph, "
+    "then list the subreddits worth following.\n\nQuestion: {query}\n\n{posts}"
+)
+
+_llm = None
+_llm_lock = threading.Lock()
+
+
+def get_llm():
+    """Return the (response-cached) LLM used for keywords and summaries, building it on first use."""
+    global _llm
+    if _llm is None:
+        with _llm_lock:
+            if _llm is None:
+                api_key = os.getenv("OPENAI_API_KEY")
+                if not api_key:
+                    raise ValueError("No OpenAI API key found. Please check your .env file.")
+                from langchain_openai import ChatOpenAI
+                _llm = CachedChatModel(ChatOpenAI(model="gpt-4o-mini", api_key=api_key, stream_usage=True))
+    return _llm
+
+
+def query_id(item):
+    """The item's "id", or a stable hash of its query so reruns recognize it."""
+    if item.get("id") is not None:
+        return str(item["id"])
+    return hashlib.sha1(item["query"].strip().encode("utf-8")).hexdigest()[:12]
+
+
+def search_query_from_keywords(keywords, max_words=SEARCH_QUERY_WORDS):
+    """A short post-search query: the first distinct words of the best keywords."""
+    words = []
+    for keyword in keywords:
+        for word in keyword.lower().split():
+            if word not in words:
+                words.append(word)
+    return " ".join(words[:max_words])
+
+
+def search_query_from_question(question, max_words=SEARCH_QUERY_WORDS):
+    """Fallback post-search query: the question's longest words (content words, mostly), in question order."""
+    words = list(dict.fromkeys(re.findall(r"[\w'-]+", question.lower())))
+    longest = set(sorted(words, key=len, reverse=True)[:max_words])
+    return " ".join(word for word in words if word in longest)
+
+
+def extract_keywords(query, count=KEYWORD_COUNT):
+    """
+    Ask the LLM for subreddit-search keywords and a short post-search query.
+
+    Returns:
+        tuple: (keywords, search query). If the reply can't be parsed, the
+               question itself is the only keyword and the query is made of
+               its longest words.
+    """
+    reply = get_llm().invoke([HumanMessage(content=KEYWORD_PROMPT.format(count=count, query=query))]).content
+    try:
+        parsed = json.loads(reply.strip().removeprefix("```json").strip("`").strip())
+    except ValueError:
+        parsed = None
+    if not isinstance(parsed, dict) or not isinstance(parsed.get("keywords"), list) or not parsed["keywords"]:
+        return [query], search_query_from_question(query)
+    keywords = [str(keyword) for keyword in parsed["keywords"][:count]]
+    search_query = str(parsed.get("search_query") or "").strip() or search_query_from_keywords(keywords)
+    return keywords, search_query
+
+
+def answer_query(item, subreddit_count=BATCH_SUBREDDITS, post_limit=BATCH_POST_LIMIT,
+                 comment_limit=BATCH_COMMENT_LIMIT):
+    """
+    Run the whole pipeline for one input item.
+
+    Returns:
+        dict: {"id", "query", "keywords", "search_query", "subreddits", "posts",
+               "summary", "error", "elapsed_s"}; "error" is None on success.
+    """
+    start = time.perf_counter()
+    query = item["query"]
+    record = {"id": query_id(item), "query": query, "keywords": item.get("keywords"),
+              "search_query": item.get("search_query"), "subreddits": [], "posts": 0,
+              "summary": None, "error": None}
+    with span("batch.query", id=record["id"]) as query_span:
+        try:
+            if not record["keywords"]:
+                record["keywords"], extracted_query = extract_keywords(query)
+                record["search_query"] = record["search_query"] or extracted_query
+            elif not record["search_query"]:
+                record["search_query"] = search_query_from_keywords(record["keywords"])
+
+            # Each question is its own scheduler session, so the Reddit quota is shared out evenly;
+            # prefetching (if enabled) searches with the same short query the posts are fetched with
+            with request_context(session=f"batch-{record['id']}", query=record["search_query"]):
+                ranked = suggest_subreddits(record["keywords"], search_limit=BATCH_SEARCH_LIMIT)
+                record["subreddits"] = [[name, round(score, 4)] for name, score in ranked]
+
+                posts = []
+                for name, _ in ranked[:subreddit_count]:
+                    posts += fetch_comments_for_query(name, record["search_query"], post_limit, comment_limit)
+            record["posts"] = len(posts)
+            if posts:
+                context = serialize_posts(presummarize_posts(posts, query))
+                prompt = SUMMARY_PROMPT.format(query=query, posts=context)
+                record["summary"] = get_llm().invoke([HumanMessage(content=prompt)]).content
+        except Exception as e:
+            query_span.record_error(e)
+            record["error"] = f"{type(e).__name__}: {e}"
+    record["elapsed_s"] = round(time.perf_counter() - start, 3)
+    return record
+
+
+def load_checkpoint(output_path):
+    """Ids already answered successfully in `output_path` (a missing file means none)."""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # A line cut off by an interrupted run
+            if record.get("error") is None:
+                done.add(record["id"])
+    return done
+
+
+def read_queries(input_path):
+    """Yield the input items one at a time, skipping blank and malformed lines."""
+    with open(input_path, encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError as e:
+                print(f"Skipping line {number}: {e}")
+                continue
+            if isinstance(item, str):
+                item = {"query": item}
+            if not isinstance(item, dict) or not str(item.get("query") or "").strip():
+                print(f"Skipping line {number}: no query")
+                continue
+            yield item
+
+
+def run_batch(input_path, output_path, concurrency=BATCH_CONCURRENCY, **options):
+    """
+    Answer every question of `input_path` not yet answered in `output_path`.
+
+    At most `concurrency` questions are in flight, and input is read only as
+    workers free up, so large files are streamed rather than loaded. Reddit
+    responses, the subreddit catalog and LLM replies are cached process-wide
+    (and on disk where configured), so questions share discovery work.
+
+    Args:
+        options: Passed on to answer_query (subreddit_count, post_limit, comment_limit).
+
+    Returns:
+        dict: {"answered", "failed", "skipped"} counts of this run.
+    """
+    done = load_checkpoint(output_path)
+    counts = {"answered": 0, "failed": 0, "skipped": 0}
+    queued = set()
+
+    # Don't glue the first new record onto a line an interrupted run left unfinished
+    torn = False
+    if os.path.exists(output_path) and os.path.getsize(output_path):
+        with open(output_path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            torn = f.read(1) != b"\n"
+
+    with open(output_path, "a", encoding="utf-8") as out, \
+            ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch") as executor:
+        if torn:
+            out.write("\n")
+
+        def write(record):
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            counts["failed" if record["error"] else "answered"] += 1
+            status = record["error"] or f"{record['posts']} posts"
+            print(f"[{counts['answered'] + counts['failed']}] {record['id']} in {record['elapsed_s']}s: {status}")
+
+        pending = set()
+        for item in read_queries(input_path):
+            item_id = query_id(item)
+            if item_id in done or item_id in queued:
+                counts["skipped"] += 1
+                continue
+            queued.add(item_id)
+            if len(pending) >= concurrency:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    write(future.result())
+            pending.add(executor.submit(answer_query, item, **options))
+        for future in pending:
+            write(future.result())
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("input", help="JSONL file of {\"query\": ..., \"id\": ..., \"keywords\": [...]}")
+    parser.add_argument("-o", "--output", required=True, help="JSONL file results are appended to")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY)
+    parser.add_argument("--subreddits", type=int, default=BATCH_SUBREDDITS, help="subreddits read per question")
+    parser.add_argument("--post-limit", type=int, default=BATCH_POST_LIMIT)
+    parser.add_argument("--comment-limit", type=int, default=BATCH_COMMENT_LIMIT)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    counts = run_batch(args.input, args.output, concurrency=args.concurrency, subreddit_count=args.subreddits,
+                       post_limit=args.post_limit, comment_limit=args.comment_limit)
+    print(f"Done in {time.perf_counter() - start:.1f}s: {counts}")
+    print(f"Reddit: {get_request_stats()}")
+    if _llm is not None:
+        print(f"LLM cache: {_llm.stats()}")
+    if counts["failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,496 @@
+"""
+Offline benchmarks of the Reddit and agent hot paths.
+
+Runs get_relevant_subreddits, fetch_comments_for_query and a full agent turn
+(with and without prefetching) against an in-process fake Reddit API and a fake chat model, reports wall time,
+Reddit requests/bytes and LLM tokens, and compares them with a stored baseline. The size of the fetch_comments
+tool result sent to the LLM is reported next to the size of its Python repr.
+
+    python benchmark.py                   # run and compare with the baseline
+    python benchmark.py --save-baseline   # run and store the results as the new baseline
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from urllib.parse import urlparse
+
+# Benchmarks never touch real services or the developer's caches
+os.environ.update({
+    "REDDIT_CACHE_PATH": os.path.join(tempfile.mkdtemp(prefix="reddit-bench-"), "cache.sqlite3"),
+    "REDDIT_CATALOG_PATH": "",
+    "LLM_CACHE_PATH": "",
+    "POST_QUEUE_PATH": ":memory:",
+    "SPAN_LOG_PATH": "",
+})
+for name in ("CLIENT_ID", "CLIENT_SECRET", "USERNAME", "PASSWORD", "OPENAI_API_KEY"):
+    os.environ.setdefault(name, "benchmark")
+
+import requests
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage, ToolMessage
+
+import reddit
+from catalog import SubredditCatalog
+from context_budget import count_tokens
+from llm_cache import CachedChatModel
+from presummarize import presummarize_posts
+from serialize import payload_stats, serialize_tool_output
+from worker_pool import get_worker_pool
+
+
+### CONSTANTS ###
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+REQUEST_LATENCY = 0.05  # Seconds the fake Reddit takes per request
+RATE_LIMIT_WINDOW = 600  # Seconds per rate-limit window of the fake Reddit, like Reddit's
+RATE_LIMIT_QUOTA = 1000  # Requests allowed per window
+LLM_LATENCY = 0.2  # Seconds the fake chat model takes before its first chunk
+REPEATS = 3  # Runs per benchmark; the median wall time is reported
+WALL_TOLERANCE = 0.25  # Slower than baseline by more than this fraction counts as a regression...
+WALL_MIN_DELTA = 0.05  # ...and by more than this many seconds (ignores jitter on cached paths)
+KEYWORDS = ["travel", "credit cards", "rewards", "points", "international travel"]
+QUERY = "best travel credit card for points"
+BENCH_PREFETCH_TOP_K = 3  # Subreddits prefetched in the agent_turn_prefetch benchmark
+HIGHER_IS_BETTER = ("prefetch_hits",)  # Metrics that regress when they shrink rather than grow
+
+WORDS = ("travel credit card cards rewards points cashback flights hotels budget airline miles bank "
+         "loans lounge annual fee transfer partners status upgrade booking international foreign "
+         "transaction sign up bonus redemption economy business class award chart portal").split()
+
+
+### FAKE REDDIT ###
+class FakeRedditData:
+    """
+    Deterministic stand-in for Reddit's data: subreddits (with rules), and the
+    posts and comments a search in one of them returns.
+
+    Listings carry the fields praw and reddit.py read plus some of the bulk a
+    real listing has (sidebar, HTML bodies), so byte counts stay realistic.
+    """
+
+    def __init__(self, seed=7, subreddits=400):
+        rng = random.Random(seed)
+        self.subreddits = []
+        for i in range(subreddits):
+            topic = rng.sample(WORDS, 3)
+            self.subreddits.append({
+                "display_name": "".join(word.capitalize() for word in topic[:2]) + str(i),
+                "public_description": " ".join(rng.sample(WORDS, 8)),
+                "description": " ".join(rng.choice(WORDS) for _ in range(150)),  # Sidebar markdown
+                "subscribers": rng.choice([300, 5000, 80000, 1200000]),
+                "user_is_banned": rng.random() < 0.03,
+                "rules_count": rng.choice([0, 3, 5, 8]),
+            })
+        self.by_name = {sub["display_name"].lower(): sub for sub in self.subreddits}
+
+    def search_subreddits(self, query, limit):
+        words = query.lower().split()
+        matches = [sub for sub in self.subreddits
+                   if all(word in sub["public_description"] or word in sub["display_name"].lower()
+                          for word in words)]
+        matches.sort(key=lambda sub: -sub["subscribers"])
+        return matches[:limit]
+
+    def search_posts(self, subreddit, query, limit):
+        rng = random.Random(f"{subreddit}/{query}")
+        return [{
+            "id": f"p{zlib.crc32(f'{subreddit}/{query}/{i}'.encode()):x}",
+            "title": " ".join(rng.sample(WORDS, 7)).capitalize() + "?",
+            "subreddit": subreddit,
+            "selftext": " ".join(rng.choice(WORDS) for _ in range(80)),
+        } for i in range(limit)]
+
+    def comments(self, post_id, limit):
+        rng = random.Random(post_id)
+        bodies = []
+        for _ in range(min(limit, 200)):
+            sentences = [" ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 18))).capitalize() + "."
+                         for _ in range(rng.randint(1, 5))]
+            bodies.append(" ".join(sentences))
+        return bodies
+
+
+def _thing(kind, data):
+    return {"kind": kind, "data": data}
+
+
+def _listing(children):
+    return {"kind": "Listing", "data": {"after": None, "before": None, "children": children}}
+
+
+class FakeRedditSession:
+    """
+    requests.Session replacement that answers the Reddit API calls this app
+    makes from FakeRedditData, after `latency` seconds, with rate-limit headers
+    counting down a RATE_LIMIT_QUOTA per RATE_LIMIT_WINDOW window.
+    """
+
+    def __init__(self, data, latency=REQUEST_LATENCY):
+        self.data = data
+        self.latency = latency
+        self.headers = {}
+        self._window_start = time.monotonic()
+        self._used = 0
+        self._lock = threading.Lock()
+
+    def _rate_limit_headers(self):
+        with self._lock:
+            elapsed = time.monotonic() - self._window_start
+            if elapsed >= RATE_LIMIT_WINDOW:
+                self._window_start += elapsed // RATE_LIMIT_WINDOW * RATE_LIMIT_WINDOW
+                self._used = 0
+            self._used += 1
+            reset = RATE_LIMIT_WINDOW - (time.monotonic() - self._window_start)
+            return {
+                "x-ratelimit-used": str(self._used),
+                "x-ratelimit-remaining": f"{max(RATE_LIMIT_QUOTA - self._used, 0):.1f}",
+                "x-ratelimit-reset": str(int(reset)),
+            }
+
+    def close(self):
+        pass
+
+    def request(self, method, url, params=None, data=None, timeout=None, **kwargs):
+        time.sleep(self.latency)
+        params = dict(params or {})
+        path = urlparse(url).path.rstrip("/")
+        status, body = self._route(method, path, params, data)
+
+        response = requests.Response()
+        response.status_code = status
+        response._content = json.dumps(body).encode("utf-8")
+        response.headers.update({"content-type": "application/json; charset=UTF-8",
+                                 **self._rate_limit_headers()})
+        response.url = url
+        return response
+
+    def _route(self, method, path, params, data):
+        if path.endswith("/api/v1/access_token"):
+            return 200, {"access_token": "benchmark", "expires_in": 86400, "scope": "*", "token_type": "bearer"}
+
+        if path == "/subreddits/search":
+            subs = self.data.search_subreddits(params.get("q", ""), int(params.get("limit", 25)))
+            return 200, _listing([_thing("t5", {k: v for k, v in sub.items() if k != "rules_count"})
+                                  for sub in subs])
+
+        match = re.fullmatch(r"/r/([^/]+)/about/rules", path)
+        if match:
+            sub = self.data.by_name.get(match.group(1).lower())
+            if sub is None:
+                return 404, {"message": "Not Found", "error": 404}
+            return 200, {"rules": [
+                {"kind": "all", "short_name": f"Rule {i + 1}", "description": "Be civil. " * 10,
+                 "violation_reason": f"Rule {i + 1}", "created_utc": 1600000000.0, "priority": i}
+                for i in range(sub["rules_count"])
+            ], "site_rules": ["Spam"]}
+
+        match = re.fullmatch(r"/r/([^/]+)/about", path)
+        if match:
+            sub = self.data.by_name.get(match.group(1).lower())
+            if sub is None:
+                return 404, {"message": "Not Found", "error": 404}
+            return 200, _thing("t5", {k: v for k, v in sub.items() if k != "rules_count"})
+
+        match = re.fullmatch(r"/r/([^/]+)/search", path)
+        if match:
+            posts = self.data.search_posts(match.group(1), params.get("q", ""), int(params.get("limit", 25)))
+            return 200, _listing([_thing("t3", {
+                **post, "url": f"https://www.reddit.com/r/{post['subreddit']}/comments/{post['id']}/post/",
+                "permalink": f"/r/{post['subreddit']}/comments/{post['id']}/post/",
+            }) for post in posts])
+
+        match = re.fullmatch(r"/comments/([^/]+)", path)
+        if match:
+            post_id = match.group(1)
+            comments = [_thing("t1", {"id": f"c{i}", "body": body, "body_html": f"<div class=\"md\"><p>{body}</p></div>",
+                                      "score": 100 - i, "author": f"user{i}"})
+                        for i, body in enumerate(self.data.comments(post_id, int(params.get("limit", 200))))]
+            comments.append(_thing("more", {"count": 50, "children": ["x"]}))
+            return 200, [_listing([_thing("t3", {"id": post_id, "title": post_id})]), _listing(comments)]
+
+        return 404, {"message": "Not Found", "error": 404}
+
+
+### FAKE LLM ###
+class FakeChatModel:
+    """
+    Scripted chat model for one agent turn: it asks for subreddits, then for the
+    comments of the best one, then answers. Counts prompt/completion tokens.
+    """
+
+    model_name = "fake-chat"
+
+    def __init__(self, latency=LLM_LATENCY):
+        self.latency = latency
+        self.reset()
+
+    def reset(self):
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def bind_tools(self, tools):
+        return self
+
+    def _reply(self, messages):
+        tool_messages = [m for m in messages if isinstance(m, ToolMessage)]
+        if not tool_messages:
+            return "", [{"name": "grab_subreddits", "args": {"keywords": KEYWORDS}}]
+        if len(tool_messages) == 1:
+            match = re.search(r"^r/(\S+)", tool_messages[-1].content, re.M)
+            subreddit = match.group(1) if match else "travel"
+            return "", [{"name": "fetch_comments", "args": {"subreddit": subreddit, "query": QUERY}}]
+        lines = tool_messages[-1].content.splitlines()
+        return "Here is what people recommend:\n" + "\n".join(lines[1:6]), []
+
+    def stream(self, messages, **kwargs):
+        self.calls += 1
+        self.prompt_tokens += sum(count_tokens(str(m.content)) + 4 for m in messages)
+        time.sleep(self.latency)
+        content, tool_calls = self._reply(messages)
+        self.completion_tokens += count_tokens(content + json.dumps([c["args"] for c in tool_calls]))
+
+        for start in range(0, len(content), 16):
+            yield AIMessageChunk(content=content[start:start + 16])
+        if tool_calls:
+            yield AIMessageChunk(content="", tool_call_chunks=[
+                {"name": call["name"], "args": json.dumps(call["args"]), "id": f"call_{self.calls}_{i}", "index": i}
+                for i, call in enumerate(tool_calls)
+            ])
+
+    def invoke(self, messages, **kwargs):
+        response = None
+        for chunk in self.stream(messages, **kwargs):
+            response = chunk if response is None else response + chunk
+        return response
+
+
+### HARNESS ###
+def reset_state(session):
+    """Fresh Reddit clients, caches, catalog, counters and scheduler for one run."""
+    reddit._pool = reddit.RedditClientPool(
+        factory=lambda: reddit.create_reddit_client(requestor_kwargs={"session": session}))
+    reddit.get_cache().clear()
+    reddit._catalog = SubredditCatalog(path="")
+    reddit._scheduler = reddit.RequestScheduler()
+    reddit._prefetcher = reddit.PrefetchCache(reddit._prefetch_comments)
+    reddit.reset_request_count()
+
+
+def settle():
+    """Wait for background work (prefetches) of the last run, so its requests are counted."""
+    pool = get_worker_pool()
+    while pool.stats()["running"] or pool.stats()["queued"]:
+        time.sleep(0.01)
+
+
+def _digest(result):
+    return f"{zlib.crc32(json.dumps(result, sort_keys=True, default=str).encode('utf-8')):08x}"
+
+
+def measure(name, func, setup, repeats, fake_llm=None):
+    """Run `func` `repeats` times after `setup()` and collect its metrics (background work untimed)."""
+    walls = []
+    for _ in range(repeats):
+        setup()
+        if fake_llm is not None:
+            fake_llm.reset()
+        reddit.reset_request_count()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):  # The code under test prints progress
+            result = func()
+        walls.append(time.perf_counter() - start)
+        settle()
+
+    stats = reddit.get_request_stats()
+    metrics = {
+        "wall_s": round(statistics.median(walls), 6),
+        "requests": stats["requests"],
+        "bytes": stats["bytes"],
+        "result": _digest(result),
+    }
+    if fake_llm is not None:
+        metrics.update(llm_calls=fake_llm.calls, prompt_tokens=fake_llm.prompt_tokens,
+                       completion_tokens=fake_llm.completion_tokens)
+    if reddit.get_prefetcher().top_k:
+        metrics["prefetch_hits"] = reddit.get_prefetch_stats()["hits"]
+    return name, metrics
+
+
+def measure_payload(name, tool_name, output):
+    """Bytes and tokens of a tool's output as sent to the LLM, next to those of its Python repr."""
+    return name, payload_stats(output, serialize_tool_output(tool_name, output))
+
+
+def run_benchmarks(latency=REQUEST_LATENCY, llm_latency=LLM_LATENCY, repeats=REPEATS):
+    """
+    Returns:
+        dict: {benchmark name: {"wall_s", "requests", "bytes", "result", ...}}.
+              "result" is a checksum of the output, to catch behavior changes.
+    """
+    session = FakeRedditSession(FakeRedditData(), latency=latency)
+    fake_llm = FakeChatModel(latency=llm_latency)
+
+    import agent  # Needs the benchmark environment above
+
+    def cold():
+        reset_state(session)
+
+    def cold_prefetch():
+        reset_state(session)
+        reddit.get_prefetcher().top_k = BENCH_PREFETCH_TOP_K
+
+    def agent_turn():
+        agent._llm_with_tools = CachedChatModel(fake_llm.bind_tools(agent.tools), path="")
+        messages = [HumanMessage(content="I want the best travel credit card for earning points.")]
+        return agent.run_turn(messages).content
+
+    def agent_turn_after_approval():
+        # The usual flow: subreddits are searched in the turn where the user approves the keywords
+        agent._llm_with_tools = CachedChatModel(fake_llm.bind_tools(agent.tools), path="")
+        messages = [HumanMessage(content="I want the best travel credit card for earning points."),
+                    AIMessage(content=f"How about these keywords: {json.dumps(KEYWORDS)}?"),
+                    HumanMessage(content="yes, looks good")]
+        return agent.run_turn(messages).content
+
+    results = dict([
+        measure("relevant_subreddits_cold", lambda: reddit.get_relevant_subreddits(KEYWORDS, search_limit=25),
+                cold, repeats),
+        measure("relevant_subreddits_warm", lambda: reddit.get_relevant_subreddits(KEYWORDS, search_limit=25),
+                lambda: None, repeats),
+        measure("comments_cold", lambda: reddit.fetch_comments_for_query("TravelCard0", QUERY),
+                cold, repeats),
+        measure("comments_warm", lambda: reddit.fetch_comments_for_query("TravelCard0", QUERY),
+                lambda: None, repeats),
+        measure("agent_turn_cold", agent_turn, cold, repeats, fake_llm=fake_llm),
+        measure("agent_turn_prefetch", agent_turn_after_approval, cold_prefetch, repeats, fake_llm=fake_llm),
+    ])
+    # What the fetch_comments tool returns to the agent for the benchmark query
+    cold()
+    with contextlib.redirect_stdout(io.StringIO()):
+        posts = presummarize_posts(reddit.fetch_comments_for_query("TravelCard0", QUERY), QUERY)
+    results.update([measure_payload("payload_fetch_comments", "fetch_comments", posts)])
+    results.update(measure_startup(repeats))
+    return results
+
+
+# Run in a fresh interpreter: import the entry point, then build its LLM
+# (what the first message needs), then re-execute app.py like a Streamlit rerun
+STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+module = __import__(sys.argv[1])
+imported = time.perf_counter()
+module.get_llm_with_tools()
+ready = time.perf_counter()
+timings = {"import": imported - start, "ready": ready - start}
+if sys.argv[1] == "app":
+    code = compile(open(module.__file__).read(), module.__file__, "exec")
+    reruns = []
+    for _ in range(5):
+        rerun_start = time.perf_counter()
+        exec(code, {"__name__": "app_rerun", "__file__": module.__file__})
+        reruns.append(time.perf_counter() - rerun_start)
+    timings["rerun"] = sorted(reruns)[len(reruns) // 2]
+print(json.dumps(timings))
+"""
+
+
+def measure_startup(repeats):
+    """
+    Cold-start cost of both entry points, each run in a new Python process.
+
+    Returns:
+        dict: {"startup_<entry>_<phase>": {"wall_s"}} for the import alone, the
+              import plus building the LLM ("ready"), and an app.py rerun.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = {**os.environ, "PYTHONPATH": here}
+    timings = {}
+    for entry in ("agent", "app"):
+        for _ in range(repeats):
+            output = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT, entry], cwd=here, env=env,
+                                    capture_output=True, text=True, check=True).stdout
+            for phase, seconds in json.loads(output.splitlines()[-1]).items():
+                timings.setdefault(f"startup_{entry}_{phase}", []).append(seconds)
+    return {name: {"wall_s": round(statistics.median(walls), 6)} for name, walls in timings.items()}
+
+
+def compare(results, baseline, tolerance=WALL_TOLERANCE):
+    """
+    Print every metric next to its baseline value.
+
+    Returns:
+        list: Regressions, as "benchmark metric: baseline -> current" strings.
+              Wall time may grow by `tolerance` (or WALL_MIN_DELTA seconds);
+              counts must not grow at all (HIGHER_IS_BETTER ones not shrink).
+    """
+    regressions = []
+    print(f"{'benchmark':<26} {'metric':<18} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name, metrics in results.items():
+        base = baseline.get(name, {})
+        for metric, value in metrics.items():
+            old = base.get(metric)
+            if metric == "result":
+                change = "" if old in (None, value) else "CHANGED"
+            elif old:
+                change = f"{(value - old) / old:+.0%}"
+            else:
+                change = ""
+            print(f"{name:<26} {metric:<18} {str(old if old is not None else '-'):>12} {str(value):>12} {change:>8}")
+
+            if old is None:
+                continue
+            if metric == "wall_s":
+                regressed = value > old * (1 + tolerance) and value - old > WALL_MIN_DELTA
+            elif metric == "result":
+                regressed = value != old
+            elif metric in HIGHER_IS_BETTER:
+                regressed = value < old
+            else:
+                regressed = value > old
+            if regressed:
+                regressions.append(f"{name} {metric}: {old} -> {value}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the baseline")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--latency", type=float, default=REQUEST_LATENCY, help="fake Reddit seconds per request")
+    parser.add_argument("--llm-latency", type=float, default=LLM_LATENCY, help="fake LLM seconds per call")
+    parser.add_argument("--repeats", type=int, default=REPEATS)
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.latency, args.llm_latency, args.repeats)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    regressions = compare(results, baseline)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baseline saved to {args.baseline}")
+    elif regressions:
+        print("Regressions against the baseline:")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
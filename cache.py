@@ -0,0 +1,165 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+### CONSTANTS ###
+CACHE_PATH = os.getenv("REDDIT_CACHE_PATH", ".reddit_cache.sqlite3")
+CACHE_MAX_ENTRIES = 20000  # Rows kept on disk before least-recently-used eviction
+MEMORY_MAX_ENTRIES = 2000  # Entries kept in the in-process tier
+
+
+class TTLCache:
+    """
+    Two-tier key/value cache with per-call TTLs and LRU eviction.
+
+    Values must be JSON serializable. Reads hit an in-process LRU dict first and
+    fall back to a SQLite table, so entries survive restarts while a warm process
+    answers repeat lookups without touching disk. Entries are namespaced (e.g.
+    "search", "subreddit", "comments") and keyed by any JSON-serializable value.
+    """
+
+    def __init__(self, path=CACHE_PATH, max_entries=CACHE_MAX_ENTRIES,
+                 memory_entries=MEMORY_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()  # (namespace, key) -> (value, stored_at)
+        self._refreshing = set()
+        self._lock = threading.RLock()
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS cache (
+                       namespace TEXT NOT NULL,
+                       key TEXT NOT NULL,
+                       value TEXT NOT NULL,
+                       stored_at REAL NOT NULL,
+                       accessed_at REAL NOT NULL,
+                       PRIMARY KEY (namespace, key))""")
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at)")
+
+    @staticmethod
+    def _encode_key(key):
+        return json.dumps(key, sort_keys=True, separators=(",", ":"))
+
+    def _lookup(self, namespace, key):
+        """Return (value, stored_at) or None, promoting disk hits into memory."""
+        mem_key = (namespace, self._encode_key(key))
+        with self._lock:
+            entry = self._memory.get(mem_key)
+            if entry is not None:
+                self._memory.move_to_end(mem_key)
+                return entry
+
+            row = self._conn.execute(
+                "SELECT value, stored_at FROM cache WHERE namespace = ? AND key = ?",
+                mem_key).fetchone()
+            if row is None:
+                return None
+            with self._conn:
+                self._conn.execute(
+                    "UPDATE cache SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                    (time.time(), *mem_key))
+            entry = (json.loads(row[0]), row[1])
+            self._remember(mem_key, entry)
+            return entry
+
+    def _remember(self, mem_key, entry):
+        self._memory[mem_key] = entry
+        self._memory.move_to_end(mem_key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, namespace, key, ttl):
+        """Return the cached value if it is younger than `ttl` seconds, else None."""
+        entry = self._lookup(namespace, key)
+        if entry is None or time.time() - entry[1] > ttl:
+            return None
+        return entry[0]
+
+    def set(self, namespace, key, value):
+        now = time.time()
+        mem_key = (namespace, self._encode_key(key))
+        with self._lock:
+            self._remember(mem_key, (value, now))
+            with self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?)",
+                    (*mem_key, json.dumps(value), now, now))
+                self._conn.execute(
+                    """DELETE FROM cache WHERE rowid IN (
+                           SELECT rowid FROM cache ORDER BY accessed_at
+                           LIMIT max(0, (SELECT COUNT(*) FROM cache) - ?))""",
+                    (self.max_entries,))
+
+    def get_or_load(self, namespace, key, loader, ttl, stale_ttl=0, refresh_loader=None):
+        """
+        Return the cached value for `key`, calling `loader()` on a miss.
+
+        Args:
+            namespace (str): Cache namespace.
+            key: JSON-serializable cache key.
+            loader (callable): Produces a fresh value. A None result is not cached.
+            ttl (float): Seconds an entry is considered fresh.
+            stale_ttl (float): Seconds past `ttl` during which the stale entry is
+                still returned immediately while a background thread reloads it
+                (stale-while-revalidate). 0 disables this.
+            refresh_loader (callable): Used instead of `loader` for those
+                background reloads, e.g. to run them at a lower priority.
+
+        Returns:
+            The cached or freshly loaded value.
+        """
+        entry = self._lookup(namespace, key)
+        if entry is not None:
+            value, stored_at = entry
+            age = time.time() - stored_at
+            if age <= ttl:
+                return value
+            if age <= ttl + stale_ttl:
+                self._refresh_in_background(namespace, key, refresh_loader or loader)
+                return value
+
+        value = loader()
+        if value is not None:
+            self.set(namespace, key, value)
+        return value
+
+    def _refresh_in_background(self, namespace, key, loader):
+        mem_key = (namespace, self._encode_key(key))
+        with self._lock:
+            if mem_key in self._refreshing:
+                return
+            self._refreshing.add(mem_key)
+
+        def refresh():
+            try:
+                value = loader()
+                if value is not None:
+                    self.set(namespace, key, value)
+            except Exception as e:
+                print(f"Error refreshing cached {namespace} entry {key}: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(mem_key)
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+    def clear(self, namespace=None):
+        """Drop every entry, or only those in `namespace`."""
+        with self._lock:
+            if namespace is None:
+                self._memory.clear()
+                with self._conn:
+                    self._conn.execute("DELETE FROM cache")
+            else:
+                for mem_key in [k for k in self._memory if k[0] == namespace]:
+                    del self._memory[mem_key]
+                with self._conn:
+                    self._conn.execute("DELETE FROM cache WHERE namespace = ?", (namespace,))
@@ -0,0 +1,211 @@
+import json
+import os
+import tempfile
+import threading
+import time
+
+from ranking import BM25Index, subreddit_tokens, tokenize
+
+
+### CONSTANTS ###
+CATALOG_PATH = os.getenv("REDDIT_CATALOG_PATH", ".subreddit_catalog.json")
+CATALOG_MAX_AGE = 7 * 24 * 60 * 60  # Seconds before an entry is considered stale
+CATALOG_REFRESH_INTERVAL = 10 * 60  # Seconds between background refresh passes
+CATALOG_REFRESH_BATCH = 50  # Max stale entries refreshed per pass
+CATALOG_MAX_FAILURES = 3  # Failed refreshes in a row (private, banned or deleted subreddits) before an entry is dropped
+
+COLUMNS = ("name", "description", "subscribers", "rules_count", "user_is_banned", "last_seen", "failures")
+DEFAULTS = {"description": "", "subscribers": 0, "rules_count": None, "user_is_banned": False, "failures": 0}
+
+
+class SubredditCatalog:
+    """
+    Local catalog of every subreddit discovered so far.
+
+    Entries are stored column by column (one JSON array per field) so the file
+    stays compact and loads with a single json.load, and a BM25 index over names
+    and descriptions is kept in memory to answer keyword lookups without Reddit.
+
+    Only entries seen within CATALOG_MAX_AGE whose last refresh succeeded are
+    returned by search(); an entry that fails CATALOG_MAX_FAILURES refreshes in
+    a row is dropped.
+    """
+
+    def __init__(self, path=CATALOG_PATH):
+        self.path = path
+        self._entries = {}  # lowercase name -> entry dict
+        self._index = None
+        self._dirty = False
+        self._lock = threading.RLock()
+        self._save_lock = threading.Lock()  # Serializes writers, so an older snapshot never replaces a newer one
+        self._refresher = None
+        self.load()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                columns = json.load(f)["columns"]
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Error loading subreddit catalog '{self.path}': {e}")
+            return
+
+        with self._lock:
+            # Columns added after a catalog was written are filled with their defaults
+            count = len(columns["name"])
+            for row in zip(*(columns.get(column) or [DEFAULTS.get(column)] * count for column in COLUMNS)):
+                entry = dict(zip(COLUMNS, row))
+                self._entries[entry["name"].lower()] = entry
+            self._index = None
+
+    def save(self):
+        """
+        Write the catalog to disk if it changed since the last save.
+
+        The file is written to a temporary file next to it and then swapped in,
+        so readers never see a partial catalog. If writing fails, the changes
+        stay marked unsaved and the error is raised.
+        """
+        with self._save_lock:
+            with self._lock:
+                if not self._dirty or not self.path:
+                    return
+                entries = list(self._entries.values())
+                data = {
+                    "version": 1,
+                    "columns": {column: [entry[column] for entry in entries] for column in COLUMNS},
+                }
+                self._dirty = False
+
+            directory, name = os.path.split(os.path.abspath(self.path))
+            tmp_path = None
+            try:
+                with tempfile.NamedTemporaryFile("w", dir=directory, prefix=f"{name}.", suffix=".tmp",
+                                                 delete=False) as f:
+                    tmp_path = f.name
+                    json.dump(data, f, separators=(",", ":"))
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                with self._lock:
+                    self._dirty = True
+                if tmp_path and os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+
+    def get(self, name):
+        with self._lock:
+            entry = self._entries.get(name.lower())
+            return dict(entry) if entry else None
+
+    def upsert(self, metadata, seen_at=None):
+        """Add or update a subreddit from a metadata dict (see COLUMNS)."""
+        with self._lock:
+            key = metadata["name"].lower()
+            entry = self._entries.get(key, {})
+            entry.update({column: metadata[column] for column in COLUMNS if metadata.get(column) is not None})
+            for column, default in DEFAULTS.items():
+                entry.setdefault(column, default)
+            entry["last_seen"] = seen_at or time.time()
+            entry["failures"] = 0
+            self._entries[key] = entry
+            self._index = None
+            self._dirty = True
+
+    def record_failure(self, name, max_failures=CATALOG_MAX_FAILURES):
+        """
+        Note a failed refresh of an entry.
+
+        The entry is hidden from search() until a refresh succeeds, and is
+        retried only once it is stale again (its `last_seen` is moved to now),
+        so unreachable subreddits don't hold up the refresh of live ones. After
+        `max_failures` failures in a row it is removed.
+        """
+        with self._lock:
+            key = name.lower()
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            entry["failures"] += 1
+            entry["last_seen"] = time.time()
+            if entry["failures"] >= max_failures:
+                print(f"Dropping r/{entry['name']} from the subreddit catalog after {max_failures} failed refreshes")
+                del self._entries[key]
+                self._index = None
+            self._dirty = True
+
+    def search(self, keyword, limit=20, match_all=False, accept=None, max_age=CATALOG_MAX_AGE):
+        """
+        Look up subreddits matching a keyword in the catalog.
+
+        Stale entries and entries whose last refresh failed are skipped.
+
+        Args:
+            match_all (bool): Only return entries containing every word of the
+                keyword, rather than any one of them.
+            accept (callable): Optional entry dict -> bool filter, applied
+                before `limit`.
+            max_age (float): Skip entries not seen for this many seconds.
+
+        Returns:
+            list: Up to `limit` entry dicts, best BM25 match first.
+        """
+        with self._lock:
+            if self._index is None:
+                self._index = BM25Index({
+                    key: subreddit_tokens(entry["name"], entry["description"])
+                    for key, entry in self._entries.items()
+                })
+            terms = tokenize(keyword)
+            scores = self._index.score(terms)
+            if match_all:
+                allowed = self._index.matching_all(terms)
+                scores = {key: score for key, score in scores.items() if key in allowed}
+            ranked = sorted(scores.items(), key=lambda item: -item[1])
+            cutoff = time.time() - max_age
+            entries = (self._entries[key] for key, _ in ranked)
+            entries = (entry for entry in entries if not entry["failures"] and entry["last_seen"] >= cutoff)
+            if accept is not None:
+                entries = (entry for entry in entries if accept(entry))
+            return [dict(entry) for _, entry in zip(range(limit), entries)]
+
+    def stale_names(self, max_age=CATALOG_MAX_AGE, limit=None):
+        """Names of entries not seen for `max_age` seconds, oldest first."""
+        cutoff = time.time() - max_age
+        with self._lock:
+            stale = sorted(
+                (entry for entry in self._entries.values() if entry["last_seen"] < cutoff),
+                key=lambda entry: entry["last_seen"])
+            return [entry["name"] for entry in stale[:limit]]
+
+    def start_refresher(self, fetch_metadata, interval=CATALOG_REFRESH_INTERVAL,
+                        max_age=CATALOG_MAX_AGE, batch_size=CATALOG_REFRESH_BATCH):
+        """
+        Start a daemon thread that keeps stale entries up to date.
+
+        Args:
+            fetch_metadata (callable): name -> metadata dict, or None on failure
+                (see record_failure).
+        """
+        if self._refresher is not None:
+            return
+
+        def refresh_forever():
+            while True:
+                time.sleep(interval)
+                try:
+                    for name in self.stale_names(max_age, limit=batch_size):
+                        metadata = fetch_metadata(name)
+                        if metadata is not None:
+                            self.upsert(metadata)
+                        else:
+                            self.record_failure(name)
+                    self.save()
+                except Exception as e:
+                    print(f"Error refreshing subreddit catalog: {e}")
+
+        self._refresher = threading.Thread(target=refresh_forever, daemon=True)
+        self._refresher.start()
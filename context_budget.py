@@ -0,0 +1,98 @@
+try:
+    import tiktoken
+except ImportError:  # Optional, fall back to a character-based estimate
+    tiktoken = None
+
+
+### CONSTANTS ###
+CONTEXT_TOKEN_BUDGET = 3000  # History tokens kept verbatim after a summarization pass
+SUMMARIZE_THRESHOLD = 6000  # History tokens that trigger folding older turns into the digest
+KEEP_RECENT_MESSAGES = 4  # Newest messages that are never summarized
+TOKENIZER_MODEL = "gpt-4o-mini"
+
+_encoding = None
+
+
+def _get_encoding():
+    """tiktoken encoding for TOKENIZER_MODEL, or None if tiktoken is unavailable."""
+    global _encoding
+    if _encoding is None:
+        _encoding = False
+        if tiktoken is not None:
+            try:
+                _encoding = tiktoken.encoding_for_model(TOKENIZER_MODEL)
+            except Exception as e:
+                # Unknown model, or the encoding file could not be downloaded
+                print(f"Using estimated token counts, tiktoken unavailable: {e}")
+    return _encoding or None
+
+
+def count_tokens(text):
+    """Token count of `text` for TOKENIZER_MODEL (about 4 characters per token without tiktoken)."""
+    encoding = _get_encoding()
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text))
+
+
+class ContextBudget:
+    """
+    Keeps the chat history sent to the LLM within a token budget.
+
+    Token counts are computed once per message. When the history that is not
+    yet summarized grows past `threshold` tokens, the oldest messages are folded
+    into a rolling digest until at most `budget` tokens (and at least
+    `keep_recent` messages) remain verbatim. The digest is cached, so the
+    summarizer only runs when the threshold is crossed again, not every turn.
+    """
+
+    def __init__(self, summarize, budget=CONTEXT_TOKEN_BUDGET, threshold=SUMMARIZE_THRESHOLD,
+                 keep_recent=KEEP_RECENT_MESSAGES):
+        """
+        Args:
+            summarize (callable): (previous digest, list of message dicts) -> new digest.
+        """
+        self.summarize = summarize
+        self.budget = budget
+        self.threshold = threshold
+        self.keep_recent = keep_recent
+        self.digest = ""
+        self.summarized_upto = 0  # messages[:summarized_upto] are covered by the digest
+        self.last_prompt_tokens = 0
+        self._tokens = []  # token count per message, filled as messages are appended
+
+    def _message_tokens(self, messages):
+        for message in messages[len(self._tokens):]:
+            self._tokens.append(count_tokens(message["content"]) + 4)  # + role/formatting overhead
+        return self._tokens
+
+    def fit(self, messages, fixed_tokens=0):
+        """
+        Return (digest, recent messages) to send for an append-only message list.
+
+        Args:
+            messages (list): Message dicts ({"role", "content"}), oldest first.
+            fixed_tokens (int): Tokens of prompt parts sent every turn (e.g. the
+                system prompt), only used for `last_prompt_tokens`.
+        """
+        tokens = self._message_tokens(messages)
+        unsummarized = sum(tokens[self.summarized_upto:])
+
+        if unsummarized > self.threshold:
+            cut = self.summarized_upto
+            last_cut = len(messages) - self.keep_recent
+            while cut < last_cut and unsummarized > self.budget:
+                unsummarized -= tokens[cut]
+                cut += 1
+            if cut > self.summarized_upto:
+                try:
+                    self.digest = self.summarize(self.digest, messages[self.summarized_upto:cut])
+                    self.summarized_upto = cut
+                except Exception as e:
+                    # Keep sending the full history rather than losing context
+                    print(f"Error summarizing conversation: {e}")
+
+        recent = messages[self.summarized_upto:]
+        self.last_prompt_tokens = (fixed_tokens + sum(tokens[self.summarized_upto:])
+                                   + (count_tokens(self.digest) if self.digest else 0))
+        return self.digest, recent
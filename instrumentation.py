@@ -0,0 +1,191 @@
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+
+
+### CONSTANTS ###
+SPAN_LOG_PATH = os.getenv("SPAN_LOG_PATH", "")  # JSON-lines span log (e.g. ".spans.jsonl"), "-" for stdout, off if empty
+RECENT_SPANS = 500  # Finished spans kept in memory for the diagnostics panel
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)  # Histogram bounds in seconds
+COUNTED_ATTRIBUTES = ("bytes", "prompt_tokens", "completion_tokens", "wait")  # Numeric attributes summed per span name
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """
+    One timed operation (a Reddit request, a tool call, an LLM call, a chat turn).
+
+    Use it as a context manager so nested spans pick it up as their parent, or
+    call end() yourself when the operation outlives a block (e.g. a generator).
+    Spans started in worker threads join the caller's trace as long as the
+    thread runs in a copy of the caller's context.
+    """
+
+    def __init__(self, name, **attributes):
+        parent = _current_span.get()
+        self.name = name
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex[:16]
+        self.span_id = uuid.uuid4().hex[:8]
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = attributes
+        self.started_at = time.time()
+        self.duration = None
+        self.error = None
+        self._start = time.perf_counter()
+        self._token = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def elapsed_ms(self):
+        return round((time.perf_counter() - self._start) * 1000, 2)
+
+    def record_error(self, error):
+        """Mark the span failed for an error that was handled rather than raised."""
+        self.error = error if isinstance(error, str) else f"{type(error).__name__}: {error}"
+
+    def end(self, error=None):
+        if self.duration is not None:
+            return
+        self.duration = time.perf_counter() - self._start
+        if error is not None:
+            self.record_error(error)
+        _record(self)
+
+    def __enter__(self):
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_span.reset(self._token)
+        self.end(exc)
+        return False
+
+    def as_dict(self):
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "started_at": round(self.started_at, 3),
+            "duration_ms": round(self.duration * 1000, 2),
+            "error": self.error,
+            **self.attributes,
+        }
+
+
+def span(name, **attributes):
+    """Start a span; `with span("reddit.request", path=...) as s: ... s.set(bytes=n)`."""
+    return Span(name, **attributes)
+
+
+### METRICS ###
+_lock = threading.Lock()
+_recent = deque(maxlen=RECENT_SPANS)
+_metrics = defaultdict(lambda: {
+    "count": 0,
+    "errors": 0,
+    "duration_sum": 0.0,
+    "buckets": [0] * len(DURATION_BUCKETS),
+    "attributes": defaultdict(float),
+})
+_log_file = None
+
+
+def _write_log(line):
+    global _log_file
+    if SPAN_LOG_PATH == "-":
+        print(line, flush=True)
+        return
+    if _log_file is None:
+        _log_file = open(SPAN_LOG_PATH, "a", buffering=1)
+    _log_file.write(line + "\n")
+
+
+def _record(finished):
+    record = finished.as_dict()
+    with _lock:
+        _recent.append(record)
+        metrics = _metrics[finished.name]
+        metrics["count"] += 1
+        metrics["errors"] += finished.error is not None
+        metrics["duration_sum"] += finished.duration
+        for i, bound in enumerate(DURATION_BUCKETS):
+            if finished.duration <= bound:
+                metrics["buckets"][i] += 1
+        for attribute in COUNTED_ATTRIBUTES:
+            value = finished.attributes.get(attribute)
+            if isinstance(value, (int, float)):
+                metrics["attributes"][attribute] += value
+
+        if SPAN_LOG_PATH:
+            try:
+                _write_log(json.dumps(record, default=str, separators=(",", ":")))
+            except OSError as e:
+                print(f"Error writing span log: {e}")
+
+
+def recent_spans(trace_id=None):
+    """Finished spans (as dicts, oldest first), optionally only those of one trace."""
+    with _lock:
+        return [record for record in _recent if trace_id is None or record["trace_id"] == trace_id]
+
+
+def last_trace_id(name):
+    """Trace id of the most recently finished span called `name` (e.g. the last "turn"), or None."""
+    with _lock:
+        for record in reversed(_recent):
+            if record["name"] == name:
+                return record["trace_id"]
+    return None
+
+
+def summarize_trace(trace_id):
+    """
+    Where the time of one trace went, per span name.
+
+    Returns:
+        list: [{"name", "count", "total_ms", "max_ms"}, ...], slowest total first.
+    """
+    summary = {}
+    for record in recent_spans(trace_id):
+        entry = summary.setdefault(record["name"], {"name": record["name"], "count": 0,
+                                                    "total_ms": 0.0, "max_ms": 0.0})
+        entry["count"] += 1
+        entry["total_ms"] = round(entry["total_ms"] + record["duration_ms"], 2)
+        entry["max_ms"] = max(entry["max_ms"], record["duration_ms"])
+    return sorted(summary.values(), key=lambda entry: -entry["total_ms"])
+
+
+def render_prometheus():
+    """All span metrics in the Prometheus text exposition format."""
+    lines = [
+        "# HELP span_duration_seconds Duration of instrumented operations.",
+        "# TYPE span_duration_seconds histogram",
+    ]
+    with _lock:
+        metrics = {name: ({**m, "buckets": list(m["buckets"])}, dict(m["attributes"]))
+                   for name, m in sorted(_metrics.items())}
+
+    for name, (m, _) in metrics.items():
+        for bound, count in zip(DURATION_BUCKETS, m["buckets"]):
+            lines.append(f'span_duration_seconds_bucket{{span="{name}",le="{bound}"}} {count}')
+        lines.append(f'span_duration_seconds_bucket{{span="{name}",le="+Inf"}} {m["count"]}')
+        lines.append(f'span_duration_seconds_sum{{span="{name}"}} {m["duration_sum"]:.6f}')
+        lines.append(f'span_duration_seconds_count{{span="{name}"}} {m["count"]}')
+
+    lines += ["# HELP span_errors_total Instrumented operations that failed.",
+              "# TYPE span_errors_total counter"]
+    lines += [f'span_errors_total{{span="{name}"}} {m["errors"]}' for name, (m, _) in metrics.items()]
+
+    lines += ["# HELP span_attribute_total Sum of numeric span attributes (bytes, tokens, wait seconds).",
+              "# TYPE span_attribute_total counter"]
+    for name, (_, attributes) in metrics.items():
+        for attribute, total in sorted(attributes.items()):
+            lines.append(f'span_attribute_total{{span="{name}",attribute="{attribute}"}} {total:g}')
+    return "\n".join(lines) + "\n"
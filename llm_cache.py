@@ -0,0 +1,176 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from langchain_core.messages import AIMessageChunk, message_chunk_to_message, message_to_dict, messages_from_dict
+
+from cache import TTLCache
+from context_budget import count_tokens
+from instrumentation import span
+
+
+### CONSTANTS ###
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "")  # SQLite file for the persistent tier, empty to disable
+LLM_CACHE_TTL = 24 * 60 * 60  # Seconds a cached response may be replayed
+LLM_CACHE_MEMORY_ENTRIES = 256  # Responses kept in the in-process LRU tier
+
+
+def _token_usage(messages, response):
+    """(prompt tokens, completion tokens) as reported by the model, else estimated."""
+    usage = getattr(response, "usage_metadata", None)
+    if usage:
+        return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+    prompt = sum(count_tokens(str(message.content)) + 4 for message in messages)
+    completion = count_tokens(str(response.content) + str(getattr(response, "tool_calls", None) or ""))
+    return prompt, completion
+
+
+def _normalize_message(message):
+    """Stable, id-free view of a message for cache keys."""
+    content = message.content
+    if isinstance(content, str):
+        content = content.strip()
+    normalized = {"type": message.type, "content": content}
+    tool_calls = getattr(message, "tool_calls", None)
+    if tool_calls:
+        normalized["tool_calls"] = [{"name": call["name"], "args": call["args"]} for call in tool_calls]
+    return normalized
+
+
+class CachedChatModel:
+    """
+    Response cache around a (tool-bound) chat model.
+
+    `invoke` and `stream` look up a SHA-256 key of the model name, the bound
+    tools and the normalized messages (whitespace-trimmed, tool call ids
+    dropped). Hits are served from an in-process LRU tier, then from an optional
+    SQLite tier with a TTL; misses call the model and store the response.
+    Replayed tool calls get fresh ids so they never clash with earlier calls in
+    the same conversation.
+    """
+
+    def __init__(self, model, path=LLM_CACHE_PATH, ttl=LLM_CACHE_TTL,
+                 memory_entries=LLM_CACHE_MEMORY_ENTRIES):
+        self.model = model
+        self.ttl = ttl
+        self.memory_entries = memory_entries
+        self.disk = TTLCache(path=path) if path else None
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()  # key -> (message dict, stored_at)
+        self._lock = threading.Lock()
+
+        bound = getattr(model, "bound", model)
+        self._model_id = {
+            "model": getattr(bound, "model_name", type(bound).__name__),
+            "kwargs": getattr(model, "kwargs", {}),
+        }
+
+    def stats(self):
+        """Hit/miss counters, e.g. to see how many LLM round trips were saved."""
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0}
+
+    def _key(self, messages):
+        payload = {**self._model_id, "messages": [_normalize_message(m) for m in messages]}
+        encoded = json.dumps(payload, sort_keys=True, default=str, separators=(",", ":"))
+        return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and time.time() - entry[1] <= self.ttl:
+                self._memory.move_to_end(key)
+                return entry[0]
+        if self.disk is not None:
+            data = self.disk.get("llm", key, ttl=self.ttl)
+            if data is not None:
+                self._remember(key, data)
+                return data
+        return None
+
+    def _remember(self, key, data):
+        with self._lock:
+            self._memory[key] = (data, time.time())
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def _put(self, key, message):
+        data = message_to_dict(message)
+        self._remember(key, data)
+        if self.disk is not None:
+            self.disk.set("llm", key, data)
+
+    def _replay(self, data):
+        message = messages_from_dict([data])[0]
+        if getattr(message, "tool_calls", None):
+            message = message.model_copy(update={"tool_calls": [
+                {**call, "id": f"call_{uuid.uuid4().hex[:24]}"} for call in message.tool_calls
+            ]})
+        return message
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def invoke(self, messages, **kwargs):
+        with span("llm.invoke", model=self._model_id["model"]) as llm_span:
+            key = self._key(messages)
+            data = self._get(key)
+            self._count(data is not None)
+            llm_span.set(cached=data is not None)
+            if data is not None:
+                return self._replay(data)
+            response = self.model.invoke(messages, **kwargs)
+            prompt_tokens, completion_tokens = _token_usage(messages, response)
+            llm_span.set(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+            self._put(key, response)
+            return response
+
+    def stream(self, messages, **kwargs):
+        # Not entered as a context manager: a generator may be resumed from other contexts
+        llm_span = span("llm.stream", model=self._model_id["model"])
+        error = None
+        try:
+            key = self._key(messages)
+            data = self._get(key)
+            self._count(data is not None)
+            llm_span.set(cached=data is not None)
+            if data is not None:
+                message = self._replay(data)
+                yield AIMessageChunk(
+                    content=message.content,
+                    tool_call_chunks=[
+                        {"name": call["name"], "args": json.dumps(call["args"]), "id": call["id"], "index": i}
+                        for i, call in enumerate(message.tool_calls)
+                    ],
+                    response_metadata=message.response_metadata,
+                    usage_metadata=message.usage_metadata,
+                )
+                return
+
+            response = None
+            for chunk in self.model.stream(messages, **kwargs):
+                if response is None:
+                    llm_span.set(first_chunk_ms=llm_span.elapsed_ms())
+                response = chunk if response is None else response + chunk
+                yield chunk
+            if response is not None:
+                prompt_tokens, completion_tokens = _token_usage(messages, response)
+                llm_span.set(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+                # Only complete responses are cached
+                self._put(key, message_chunk_to_message(response))
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            llm_span.end(error)
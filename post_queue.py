@@ -0,0 +1,184 @@
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+
+### CONSTANTS ###
+POST_QUEUE_PATH = os.getenv("POST_QUEUE_PATH", ".post_queue.sqlite3")
+POST_WORKERS = 2  # Posts submitted at once (requests still go through the Reddit scheduler)
+POST_MAX_ATTEMPTS = 5  # Submissions tried per job before it is marked failed
+POST_RETRY_BASE = 5  # Seconds before the first retry, doubled after every failed attempt
+POST_RETRY_MAX = 10 * 60  # Longest wait between two attempts
+
+JOB_FIELDS = ["id", "subreddit", "title", "status", "attempts", "url", "error"]
+
+
+class PostQueue:
+    """
+    Persistent queue of Reddit submissions worked off by background threads.
+
+    Jobs live in a SQLite table, so queued posts survive restarts. Each job is
+    one (subreddit, title) pair; enqueueing the same pair again returns the
+    existing job instead of posting twice (a failed job is queued again).
+    Transient failures are retried with exponential backoff, anything else
+    fails the job right away.
+
+    Job status goes queued -> running -> submitted | failed.
+    """
+
+    def __init__(self, submit_post, is_transient, path=POST_QUEUE_PATH, workers=POST_WORKERS,
+                 max_attempts=POST_MAX_ATTEMPTS):
+        """
+        Args:
+            submit_post (callable): (subreddit, title, content) -> post URL; raises on failure.
+            is_transient (callable): exception -> True if the submission may be retried.
+        """
+        self.submit_post = submit_post
+        self.is_transient = is_transient
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self._threads = []
+        self._cond = threading.Condition()
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS jobs (
+                       id TEXT PRIMARY KEY,
+                       subreddit TEXT NOT NULL,
+                       title TEXT NOT NULL,
+                       content TEXT NOT NULL,
+                       dedupe_key TEXT NOT NULL UNIQUE,
+                       status TEXT NOT NULL,
+                       attempts INTEGER NOT NULL DEFAULT 0,
+                       url TEXT,
+                       error TEXT,
+                       next_attempt_at REAL NOT NULL,
+                       created_at REAL NOT NULL,
+                       updated_at REAL NOT NULL)""")
+            # Jobs interrupted by a restart are picked up again
+            self._conn.execute("UPDATE jobs SET status = 'queued' WHERE status = 'running'")
+
+    @staticmethod
+    def _dedupe_key(subreddit, title):
+        return f"{subreddit.strip().lower()}\n{title.strip()}"
+
+    def _job(self, job_id):
+        row = self._conn.execute(
+            f"SELECT {', '.join(JOB_FIELDS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(zip(JOB_FIELDS, row)) if row else None
+
+    def enqueue(self, subreddits, title, content):
+        """
+        Queue one post (same title and body) for each subreddit and return right away.
+
+        Returns:
+            list: One job dict per subreddit ({"id", "subreddit", "title",
+                  "status", "attempts", "url", "error"}), in input order.
+        """
+        jobs = []
+        now = time.time()
+        with self._cond:
+            with self._conn:
+                for subreddit in subreddits:
+                    subreddit = subreddit.strip().removeprefix("r/")
+                    key = self._dedupe_key(subreddit, title)
+                    self._conn.execute(
+                        """INSERT OR IGNORE INTO jobs (id, subreddit, title, content, dedupe_key, status,
+                                                       next_attempt_at, created_at, updated_at)
+                           VALUES (?, ?, ?, ?, ?, 'queued', ?, ?, ?)""",
+                        (uuid.uuid4().hex[:12], subreddit, title, content, key, now, now, now))
+                    # Retrying a failed post is allowed, a queued or submitted one is not duplicated
+                    self._conn.execute(
+                        """UPDATE jobs SET status = 'queued', content = ?, attempts = 0, error = NULL,
+                                           next_attempt_at = ?, updated_at = ?
+                           WHERE dedupe_key = ? AND status = 'failed'""",
+                        (content, now, now, key))
+                    job_id = self._conn.execute(
+                        "SELECT id FROM jobs WHERE dedupe_key = ?", (key,)).fetchone()[0]
+                    jobs.append(self._job(job_id))
+            self._cond.notify_all()
+        self.start()
+        return jobs
+
+    def status(self, job_ids):
+        """Current job dicts for `job_ids` (unknown ids are skipped)."""
+        with self._cond:
+            return [job for job in map(self._job, job_ids) if job is not None]
+
+    def wait(self, job_ids, timeout=None):
+        """Block until none of the jobs is queued or running (or `timeout` passes); return their status."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            jobs = self.status(job_ids)
+            if all(job["status"] in ("submitted", "failed") for job in jobs):
+                return jobs
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return jobs
+            with self._cond:
+                self._cond.wait(timeout=min(remaining or 1.0, 1.0))
+
+    def start(self):
+        """Start the worker threads (once)."""
+        with self._cond:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"post-queue-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _claim(self):
+        """Mark the next due job running and return it, or return the seconds until one is due."""
+        with self._cond, self._conn:
+            row = self._conn.execute(
+                """SELECT id, next_attempt_at FROM jobs WHERE status = 'queued'
+                   ORDER BY next_attempt_at, created_at LIMIT 1""").fetchone()
+            if row is None:
+                return None, None
+            job_id, next_attempt_at = row
+            wait = next_attempt_at - time.time()
+            if wait > 0:
+                return None, wait
+            self._conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                (time.time(), job_id))
+            row = self._conn.execute(
+                "SELECT subreddit, title, content, attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            return (job_id, *row), None
+
+    def _finish(self, job_id, status, url=None, error=None, next_attempt_at=0.0):
+        now = time.time()
+        with self._cond:
+            with self._conn:
+                self._conn.execute(
+                    """UPDATE jobs SET status = ?, url = ?, error = ?, next_attempt_at = ?, updated_at = ?
+                       WHERE id = ?""",
+                    (status, url, error, next_attempt_at or now, now, job_id))
+            self._cond.notify_all()
+
+    def _work(self):
+        while True:
+            job, wait = self._claim()
+            if job is None:
+                with self._cond:
+                    self._cond.wait(timeout=wait)
+                continue
+
+            job_id, subreddit, title, content, attempts = job
+            try:
+                url = self.submit_post(subreddit, title, content)
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+                if self.is_transient(e) and attempts < self.max_attempts:
+                    delay = min(POST_RETRY_BASE * 2 ** (attempts - 1), POST_RETRY_MAX)
+                    print(f"Post to r/{subreddit} failed ({error}), retrying in {delay}s")
+                    self._finish(job_id, "queued", error=error, next_attempt_at=time.time() + delay)
+                else:
+                    print(f"Post to r/{subreddit} failed: {error}")
+                    self._finish(job_id, "failed", error=error)
+            else:
+                self._finish(job_id, "submitted", url=url)
@@ -0,0 +1,149 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError
+
+from worker_pool import PoolBusy, get_worker_pool
+
+
+### CONSTANTS ###
+PREFETCH_TOP_K = int(os.getenv("REDDIT_PREFETCH_TOP_K", 0))  # Suggested subreddits prefetched, 0 turns prefetching off
+PREFETCH_POST_LIMIT = 5  # Posts fetched per prefetched subreddit
+PREFETCH_COMMENT_LIMIT = 5  # Top comments fetched per prefetched post
+PREFETCH_REQUEST_BUDGET = int(os.getenv("REDDIT_PREFETCH_BUDGET", 20))  # Max Reddit requests one prefetch may spend
+PREFETCH_TTL = 5 * 60  # Seconds prefetched posts stay usable
+PREFETCH_SESSIONS = 64  # Sessions whose prefetched posts are kept (least recently used are dropped)
+PREFETCH_WAIT_TIMEOUT = 2  # Seconds a lookup waits for a running prefetch before the caller fetches live
+
+_WORD = re.compile(r"\w+")
+
+
+def _terms(query):
+    return set(_WORD.findall(query.lower()))
+
+
+class PrefetchCache:
+    """
+    Speculative, per-session cache of posts and comments for suggested subreddits.
+
+    Once subreddits have been suggested for a user's question, prefetch() fetches
+    the top posts of the best few in the background, best first, so the
+    follow-up comment lookup doesn't start cold. The work runs as one job on the
+    shared worker pool and only if the pool has room right away; prefetching
+    never makes anyone wait.
+
+    A lookup is a hit when the same session prefetched that subreddit, the
+    lookup's query words all occur in the prefetched question (the LLM usually
+    searches with a shortened form of it), and no more posts or comments are
+    asked for than were prefetched.
+    """
+
+    def __init__(self, load, top_k=PREFETCH_TOP_K, post_limit=PREFETCH_POST_LIMIT,
+                 comment_limit=PREFETCH_COMMENT_LIMIT, budget=PREFETCH_REQUEST_BUDGET, ttl=PREFETCH_TTL,
+                 wait_timeout=PREFETCH_WAIT_TIMEOUT):
+        """
+        Args:
+            load (callable): (subreddit, query, post_limit, comment_limit) -> list of
+                {"id", "title", "url", "comments"} dicts; runs in a worker thread.
+            budget (int): Reddit requests one prefetch may spend; each subreddit
+                costs one search plus one request per post.
+            wait_timeout (float): Seconds get() waits for a prefetch that is
+                already running.
+        """
+        self.load = load
+        self.top_k = top_k
+        self.post_limit = post_limit
+        self.comment_limit = comment_limit
+        self.budget = budget
+        self.ttl = ttl
+        self.wait_timeout = wait_timeout
+        self._sessions = OrderedDict()  # session -> {subreddit: (query terms, Future, stored_at)}
+        self._lock = threading.Lock()
+        self._stats = {"prefetched": 0, "skipped": 0, "lookups": 0, "hits": 0, "timeouts": 0}
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self._stats[name] += n
+
+    def prefetch(self, session, subreddits, query):
+        """
+        Start prefetching the first subreddits of `subreddits` (best first) for `query`.
+
+        Returns:
+            list: Names of the subreddits being prefetched (empty if off, over
+                  budget or the pool is busy).
+        """
+        top_k = min(self.top_k, self.budget // (1 + self.post_limit))
+        if top_k <= 0 or not query:
+            return []
+
+        futures = [(subreddit, Future()) for subreddit in subreddits[:top_k]]
+        try:
+            get_worker_pool().submit(self._run, futures, query, session=session, timeout=0)
+        except PoolBusy:
+            self._count("skipped")
+            return []
+
+        terms = _terms(query)
+        now = time.time()
+        with self._lock:
+            entries = self._sessions.pop(session, {})
+            entries.update({subreddit.lower(): (terms, future, now) for subreddit, future in futures})
+            self._sessions[session] = entries
+            while len(self._sessions) > PREFETCH_SESSIONS:
+                self._sessions.popitem(last=False)
+        return [subreddit for subreddit, _ in futures]
+
+    def _run(self, futures, query):
+        for subreddit, future in futures:
+            # A lookup that found this subreddit not yet started has cancelled it
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(self.load(subreddit, query, self.post_limit, self.comment_limit))
+                self._count("prefetched")
+            except Exception as e:
+                print(f"Error prefetching r/{subreddit}: {e}")
+                future.set_result(None)
+
+    def get(self, session, subreddit, query, post_limit, comment_limit):
+        """
+        Prefetched posts matching the lookup, trimmed to its limits, or None.
+
+        Waits up to `wait_timeout` seconds for a prefetch of this subreddit that
+        is already running (it runs at background priority, so under load the
+        caller's own interactive fetch may well be faster); one that has not
+        started yet is cancelled. Both count as a miss, so the caller can fetch
+        live right away.
+        """
+        self._count("lookups")
+        if post_limit > self.post_limit or comment_limit > self.comment_limit:
+            return None
+        with self._lock:
+            entry = self._sessions.get(session, {}).get(subreddit.lower())
+        if entry is None:
+            return None
+        terms, future, stored_at = entry
+        if time.time() - stored_at > self.ttl or not _terms(query) <= terms:
+            return None
+        if future.cancel():
+            return None
+
+        try:
+            posts = future.result(timeout=self.wait_timeout)
+        except TimeoutError:
+            self._count("timeouts")
+            return None
+        if posts is None:
+            return None
+        self._count("hits")
+        return [{**post, "comments": post["comments"][:comment_limit]} for post in posts[:post_limit]]
+
+    def stats(self):
+        """Prefetch counters and the share of comment lookups served from prefetched posts."""
+        with self._lock:
+            stats = dict(self._stats)
+        stats["hit_rate"] = round(stats["hits"] / stats["lookups"], 3) if stats["lookups"] else 0.0
+        return stats
@@ -0,0 +1,104 @@
+import hashlib
+import re
+from collections import Counter
+
+from ranking import BM25Index, tokenize
+
+
+### CONSTANTS ###
+COMMENT_CHAR_BUDGET = 3000  # Characters of extracted comment text passed to the LLM in total
+MIN_SENTENCE_TOKENS = 3  # Shorter fragments ("This.", "+1") are dropped
+SIMHASH_MAX_DISTANCE = 3  # Sentences whose 64-bit SimHashes differ in at most this many bits are near-duplicates
+RANK_PRIOR = 0.5  # Score bonus for sentences from higher-ranked comments
+
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+|\n+")
+
+
+def split_sentences(text):
+    return [sentence.strip() for sentence in _SENTENCE_RE.split(text or "") if sentence.strip()]
+
+
+def simhash(tokens):
+    """64-bit SimHash of a token list."""
+    weights = [0] * 64
+    for token, count in Counter(tokens).items():
+        bits = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "big")
+        for i in range(64):
+            weights[i] += count if bits >> i & 1 else -count
+    return sum(1 << i for i, weight in enumerate(weights) if weight > 0)
+
+
+def _is_near_duplicate(fingerprint, kept_fingerprints):
+    return any(bin(fingerprint ^ kept).count("1") <= SIMHASH_MAX_DISTANCE for kept in kept_fingerprints)
+
+
+def presummarize_posts(posts, query, char_budget=COMMENT_CHAR_BUDGET):
+    """
+    Reduce fetched comments to the sentences most relevant to `query`.
+
+    Comments are split into sentences and each sentence is scored with BM25
+    against the query, plus a small bonus for coming from a higher-ranked
+    comment. Near-duplicate sentences (by SimHash) are collapsed. The best
+    sentence of every post is kept first, then the best remaining ones overall,
+    until `char_budget` characters are used.
+
+    Args:
+        posts (list): fetch_comments_for_query results ({"id", "title", "url", "comments"}).
+        query (str): The user's question or search query.
+        char_budget (int): Max characters of comment text to keep in total.
+
+    Returns:
+        list: Posts in the same shape and order; each post's "comments" holds
+              the extracted sentences, grouped per source comment in their
+              original order.
+    """
+    sentences = {}  # (post, comment, sentence) position -> (text, tokens)
+    for p, post in enumerate(posts):
+        for c, comment in enumerate(post["comments"]):
+            for s, sentence in enumerate(split_sentences(comment)):
+                tokens = tokenize(sentence)
+                if len(tokens) >= MIN_SENTENCE_TOKENS:
+                    sentences[(p, c, s)] = (sentence, tokens)
+
+    index = BM25Index({key: tokens for key, (_, tokens) in sentences.items()})
+    relevance = index.score(tokenize(query))
+    scores = {
+        key: relevance.get(key, 0.0) + RANK_PRIOR / (1 + key[1])
+        for key in sentences
+    }
+
+    # Best sentence of each post first, then everything else by score
+    ranked = sorted(sentences, key=lambda key: -scores[key])
+    best_per_post = {}
+    for key in ranked:
+        best_per_post.setdefault(key[0], key)
+    firsts = set(best_per_post.values())
+    ordered = list(best_per_post.values()) + [key for key in ranked if key not in firsts]
+
+    selected = []
+    fingerprints = []
+    used = 0
+    for key in ordered:
+        text, tokens = sentences[key]
+        if used + len(text) > char_budget:
+            continue
+        fingerprint = simhash(tokens)
+        if _is_near_duplicate(fingerprint, fingerprints):
+            continue
+        fingerprints.append(fingerprint)
+        selected.append(key)
+        used += len(text)
+
+    extracted = [{} for _ in posts]  # per post: comment position -> [sentence, ...]
+    for p, c, s in sorted(selected):
+        extracted[p].setdefault(c, []).append(sentences[(p, c, s)][0])
+
+    return [
+        {
+            "id": post.get("id"),
+            "title": post["title"],
+            "url": post["url"],
+            "comments": [" ".join(parts) for _, parts in sorted(extracted[p].items())]
+        }
+        for p, post in enumerate(posts)
+    ]
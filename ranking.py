@@ -0,0 +1,134 @@
+import math
+import re
+from collections import Counter, defaultdict
+
+
+### CONSTANTS ###
+BM25_K1 = 1.5  # Term-frequency saturation
+BM25_B = 0.75  # Document-length normalization
+NAME_WEIGHT = 2  # Subreddit names count this many times as often as description words
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+_CAMEL_RE = re.compile(r"(?<=[a-z])(?=[A-Z])|(?<=[A-Za-z])(?=[0-9])|_")
+_SUFFIXES = (("sses", "ss"), ("ies", "y"), ("xes", "x"), ("ches", "ch"), ("shes", "sh"),
+             ("ing", ""), ("ed", ""), ("ss", "ss"), ("s", ""))
+
+
+def stem(token):
+    """Very small suffix-stripping stemmer ("cards" -> "card", "flies" -> "fly")."""
+    for suffix, replacement in _SUFFIXES:
+        if token.endswith(suffix):
+            if len(token) - len(suffix) + len(replacement) < 3:
+                return token
+            return token[:-len(suffix)] + replacement
+    return token
+
+
+def tokenize(text):
+    """Lowercase, split CamelCase/snake_case names and stem every word."""
+    text = _CAMEL_RE.sub(" ", text or "")
+    return [stem(word) for word in _WORD_RE.findall(text.lower())]
+
+
+class BM25Index:
+    """
+    Inverted index over a set of documents, scored with Okapi BM25.
+
+    Documents are tokenized once when the index is built; a query then only
+    walks the postings of its own terms, so ranking thousands of candidates is
+    a single pass over the matching postings rather than a scan of every text.
+    """
+
+    def __init__(self, documents, k1=BM25_K1, b=BM25_B):
+        """
+        Args:
+            documents (dict): {doc_id: list of tokens}.
+        """
+        self.k1 = k1
+        self.b = b
+        self.doc_lengths = {}
+        self.postings = defaultdict(list)  # term -> [(doc_id, term frequency), ...]
+
+        for doc_id, tokens in documents.items():
+            self.doc_lengths[doc_id] = len(tokens)
+            for term, frequency in Counter(tokens).items():
+                self.postings[term].append((doc_id, frequency))
+
+        self.doc_count = len(self.doc_lengths)
+        self.avg_length = (sum(self.doc_lengths.values()) / self.doc_count) if self.doc_count else 0.0
+
+    def idf(self, term):
+        doc_frequency = len(self.postings.get(term, ()))
+        return math.log(1 + (self.doc_count - doc_frequency + 0.5) / (doc_frequency + 0.5))
+
+    def score(self, query_terms, scores=None):
+        """
+        Add the BM25 score of every document matching `query_terms` into `scores`.
+
+        Returns:
+            dict: {doc_id: score} for documents containing at least one term.
+        """
+        scores = defaultdict(float) if scores is None else scores
+        for term in set(query_terms):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = self.idf(term)
+            for doc_id, frequency in postings:
+                length_norm = 1 - self.b + self.b * self.doc_lengths[doc_id] / (self.avg_length or 1)
+                scores[doc_id] += idf * frequency * (self.k1 + 1) / (frequency + self.k1 * length_norm)
+        return scores
+
+
+    def matching_all(self, query_terms):
+        """Ids of the documents that contain every one of `query_terms`."""
+        terms = set(query_terms)
+        if not terms:
+            return set()
+        matches = None
+        for term in terms:
+            docs = {doc_id for doc_id, _ in self.postings.get(term, ())}
+            matches = docs if matches is None else matches & docs
+            if not matches:
+                break
+        return matches
+
+
+def subreddit_tokens(name, description):
+    """Tokens for one subreddit, with the name weighted above the description."""
+    return tokenize(name) * NAME_WEIGHT + tokenize(description)
+
+
+def rank_subreddits(keywords, candidates, boosts=None):
+    """
+    Rank subreddits against a list of keywords with BM25.
+
+    Each keyword (which may be several words) is scored as its own query and
+    the per-keyword scores are summed, so a subreddit matching many distinct
+    keywords ranks above one matching a single keyword many times.
+
+    Args:
+        keywords (list): Keywords or key phrases.
+        candidates (dict): {subreddit name: description}.
+        boosts (dict): Optional {subreddit name: multiplier} applied to the score.
+
+    Returns:
+        list: [(subreddit name, score), ...] for subreddits with a positive
+              score, highest first. Ties keep the order of `candidates`.
+    """
+    index = BM25Index({
+        name: subreddit_tokens(name, description)
+        for name, description in candidates.items()
+    })
+
+    scores = defaultdict(float)
+    for keyword in keywords:
+        index.score(tokenize(keyword), scores)
+
+    order = {name: position for position, name in enumerate(candidates)}
+    ranked = [
+        (name, round(score * (boosts or {}).get(name, 1), 3))
+        for name, score in scores.items() if score > 0
+    ]
+    ranked.sort(key=lambda item: (-item[1], order[item[0]]))
+    return ranked
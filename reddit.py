@@ -1,9 +1,23 @@
+import contextvars
 import os
-from webbrowser import get
-import praw
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from urllib.parse import urlparse
+import prawcore
+from prawcore.rate_limit import RateLimiter
+from cache import TTLCache
+from instrumentation import span
+from catalog import CATALOG_REFRESH_INTERVAL, SubredditCatalog
+from post_queue import PostQueue
+from prefetch import PrefetchCache
+from ranking import rank_subreddits
+from rerank import RERANK_TOP_K, rerank_subreddits
 from dotenv import load_dotenv
 load_dotenv()
-from collections import defaultdict
+from collections import OrderedDict, defaultdict, deque, namedtuple
 
 
 ### CONSTANTS ###
@@ -12,89 +26,725 @@ top_n = 10
 USER_AGENT = "ToastyPostyBot/1.0 by u/One-Cap-3906"
 SEARCH_LIMIT = 20  # Number of posts to fetch
 COMMENT_LIMIT = 5  # Number of top comments to fetch per post
+COMMENT_SORT = "confidence"  # Reddit's "best" order, the default of the comments page
 SUMMARY_TOKEN_LIMIT = 200  # Token limit for GPT summarization
+INTERACTIVE_CLIENTS = 1  # Pooled clients background work may never borrow, so a user's request always gets one
+CLIENT_POOL_SIZE = int(os.getenv("REDDIT_POOL_SIZE", 4 + INTERACTIVE_CLIENTS))  # Max authenticated clients kept alive
+TOKEN_REFRESH_MARGIN = 300  # Refresh OAuth tokens this many seconds before they expire
+SEARCH_CONCURRENCY = int(os.getenv("REDDIT_SEARCH_CONCURRENCY",  # Parallel keyword searches
+                                   max(1, CLIENT_POOL_SIZE - INTERACTIVE_CLIENTS)))
+SEARCH_CACHE_TTL = 6 * 60 * 60  # Seconds a keyword's subreddit search results stay fresh
+METADATA_CACHE_TTL = 24 * 60 * 60  # Seconds a subreddit's metadata (incl. rules count) stays fresh
+COMMENTS_CACHE_TTL = 60 * 60  # Seconds fetched posts and comments stay fresh
+CACHE_STALE_TTL = 24 * 60 * 60  # Serve expired entries this much longer while refreshing in the background
+COMMENT_CONCURRENCY = int(os.getenv("REDDIT_COMMENT_CONCURRENCY",  # Posts fetched in parallel, one session
+                                    max(1, CLIENT_POOL_SIZE - INTERACTIVE_CLIENTS)))
+CATALOG_MIN_HITS = 5  # Keywords with fewer catalog matches than this are searched live
+MIN_SUBSCRIBERS = 1000  # Smaller subreddits are dropped during vetting
+RATE_LIMIT_PER_MINUTE = 100  # Reddit's OAuth limit per client id, used until headers say otherwise
+RATE_LIMIT_BURST = 10  # Requests that may go out back to back when tokens have built up
+RATE_LIMIT_RESERVE = 50  # Requests of the current window kept back; the rest may be spent in a burst
+PRIORITY_INTERACTIVE = 0  # Requests a user is waiting on (fetching comments, posting)
+PRIORITY_BACKGROUND = 1  # Discovery and refresh work
+POST_WAIT_TIMEOUT = 15  # Seconds queue_posts() waits for the submissions before returning their jobs
 
 
+### REQUEST ACCOUNTING ###
+_request_stats = {"requests": 0, "bytes": 0}
+_request_stats_lock = threading.Lock()
+
+
+def record_request(response_bytes=0):
+    """Count one HTTP request made to Reddit and the size of its response body."""
+    with _request_stats_lock:
+        _request_stats["requests"] += 1
+        _request_stats["bytes"] += response_bytes
+
+
+def get_request_count():
+    """Number of HTTP requests made to Reddit by this process (including token requests)."""
+    return _request_stats["requests"]
+
+
+def get_request_stats():
+    """Requests made to Reddit and response bytes received, as a dict."""
+    with _request_stats_lock:
+        return dict(_request_stats)
+
+
+def reset_request_count():
+    with _request_stats_lock:
+        _request_stats["requests"] = 0
+        _request_stats["bytes"] = 0
+
+
+### RATE LIMITING ###
+_request_priority = contextvars.ContextVar("reddit_request_priority", default=PRIORITY_BACKGROUND)
+_request_session = contextvars.ContextVar("reddit_request_session", default="default")
+_request_query = contextvars.ContextVar("reddit_request_query", default=None)
+
+
+@contextmanager
+def request_context(priority=None, session=None, query=None):
+    """
+    Tag the Reddit requests made inside this block with a priority class and/or session.
+
+    `query` is the user's question being answered; suggested subreddits are
+    prefetched for it (see get_prefetcher). Worker threads started by this
+    module inherit the caller's tags.
+    """
+    tokens = []
+    if priority is not None:
+        tokens.append((_request_priority, _request_priority.set(priority)))
+    if session is not None:
+        tokens.append((_request_session, _request_session.set(session)))
+    if query is not None:
+        tokens.append((_request_query, _request_query.set(query)))
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+class RequestScheduler:
+    """
+    Process-wide token bucket that every Reddit request must pass through.
+
+    Waiting requests are served strictly by priority class; within a class the
+    sessions take turns (round robin), so one busy session can't starve the
+    others. The bucket follows Reddit's X-Ratelimit-Remaining/-Reset response
+    headers: while the current window has more than RATE_LIMIT_RESERVE requests
+    left, the surplus may be spent right away; below that, the remaining quota
+    is spread over the time left in the window.
+    """
+
+    def __init__(self, per_minute=RATE_LIMIT_PER_MINUTE, burst=RATE_LIMIT_BURST):
+        self.default_rate = per_minute / 60
+        self.burst = burst
+        self._capacity = burst
+        self._rate = self.default_rate
+        self._tokens = float(burst)
+        self._updated_at = time.monotonic()
+        self._window_reset_at = 0.0
+        self._queues = {}  # priority -> OrderedDict(session -> deque of tickets)
+        self._cond = threading.Condition()
+        self._waits = defaultdict(lambda: {"requests": 0, "total_wait": 0.0, "max_wait": 0.0})
+
+    def _refill(self):
+        now = time.monotonic()
+        if self._window_reset_at and now >= self._window_reset_at:
+            self._rate = self.default_rate
+            self._capacity = self.burst
+            self._window_reset_at = 0.0
+        self._tokens = min(self._capacity, self._tokens + (now - self._updated_at) * self._rate)
+        self._updated_at = now
+
+    def _next_ticket(self):
+        for priority in sorted(self._queues):
+            sessions = self._queues[priority]
+            if sessions:
+                return next(iter(sessions.values()))[0]
+        return None
+
+    def acquire(self, priority=None, session=None):
+        """
+        Block until this request may be sent; defaults come from request_context().
+
+        Returns:
+            float: Seconds spent waiting.
+        """
+        priority = _request_priority.get() if priority is None else priority
+        session = _request_session.get() if session is None else session
+        ticket = object()
+        start = time.monotonic()
+
+        with self._cond:
+            sessions = self._queues.setdefault(priority, OrderedDict())
+            sessions.setdefault(session, deque()).append(ticket)
+            while True:
+                self._refill()
+                if self._next_ticket() is ticket and self._tokens >= 1:
+                    break
+                wait = None  # Woken up by the request ahead of this one
+                if self._tokens < 1:
+                    if self._rate > 0:
+                        wait = (1 - self._tokens) / self._rate
+                    else:
+                        wait = max(self._window_reset_at - time.monotonic(), 0.1)
+                self._cond.wait(timeout=wait)
+
+            self._tokens -= 1
+            tickets = sessions.pop(session)
+            tickets.popleft()
+            if tickets:
+                sessions[session] = tickets  # Back of the line, so other sessions go next
+
+            waited = time.monotonic() - start
+            stats = self._waits[priority]
+            stats["requests"] += 1
+            stats["total_wait"] += waited
+            stats["max_wait"] = max(stats["max_wait"], waited)
+            self._cond.notify_all()
+        return waited
+
+    def update_from_headers(self, headers):
+        """Adjust the bucket to the X-Ratelimit-* headers of a Reddit response."""
+        try:
+            remaining = float(headers["x-ratelimit-remaining"])
+            reset = float(headers["x-ratelimit-reset"])
+        except (KeyError, TypeError, ValueError):
+            return
+        remaining = max(remaining, 0)
+        with self._cond:
+            self._refill()
+            self._rate = remaining / max(reset, 1)
+            spare = remaining - RATE_LIMIT_RESERVE
+            if spare > 0:
+                self._capacity = max(self.burst, spare)
+                self._tokens = spare
+            else:
+                self._capacity = self.burst
+                self._tokens = min(self._tokens, remaining)
+            self._window_reset_at = time.monotonic() + reset
+            self._cond.notify_all()
+
+    def stats(self):
+        """Queue depth and wait-time metrics per priority class."""
+        with self._cond:
+            return {
+                "tokens": round(self._tokens, 2),
+                "rate_per_second": round(self._rate, 3),
+                "queue_depth": {
+                    priority: sum(len(tickets) for tickets in sessions.values())
+                    for priority, sessions in self._queues.items()
+                },
+                "waits": {
+                    priority: {
+                        "requests": stats["requests"],
+                        "avg_wait": round(stats["total_wait"] / stats["requests"], 4),
+                        "max_wait": round(stats["max_wait"], 4),
+                    }
+                    for priority, stats in self._waits.items()
+                },
+            }
+
+
+_scheduler = RequestScheduler()
+
+
+def get_scheduler_stats():
+    """Queue depth and wait-time metrics of the shared Reddit request scheduler."""
+    return _scheduler.stats()
+
+
+class _UnpacedRateLimiter(RateLimiter):
+    """prawcore RateLimiter without its per-client sleeps; RequestScheduler paces all clients together."""
+
+    def delay(self):
+        pass
+
+
+class CountingRequestor(prawcore.Requestor):
+    """prawcore Requestor that schedules and records every request it sends."""
+
+    def request(self, method, url, *args, **kwargs):
+        with span("reddit.request", method=method, path=urlparse(url).path,
+                  priority=_request_priority.get()) as request_span:
+            request_span.set(wait=round(_scheduler.acquire(), 4))
+            try:
+                response = super().request(method, url, *args, **kwargs)
+            except Exception:
+                record_request()
+                raise
+            record_request(len(response.content or b""))
+            request_span.set(status=response.status_code, bytes=len(response.content or b""))
+            _scheduler.update_from_headers(response.headers)
+            return response
+
+
+### CLIENT POOL ###
+def create_reddit_client(requestor_kwargs=None):
+    """
+    Build a new authenticated praw.Reddit instance from the .env credentials.
+
+    Args:
+        requestor_kwargs (dict): Optional extra arguments for the requestor,
+            e.g. {"session": ...} to send requests through another HTTP session.
+    """
+    import praw  # Deferred so importing this module stays cheap
 
-def get_relevant_subreddits(keywords, search_limit=100):
-    # Initialize Reddit API
     reddit = praw.Reddit(client_id=os.getenv("CLIENT_ID"),
                          client_secret=os.getenv("CLIENT_SECRET"),
                          username=os.getenv("USERNAME"),
                          password=os.getenv("PASSWORD"),
-                         user_agent="ToastyPostyBot/1.0 by u/One-Cap-3906")
+                         user_agent=USER_AGENT,
+                         requestor_class=CountingRequestor,
+                         requestor_kwargs=requestor_kwargs)
+    for attr in ("_authorized_core", "_read_only_core"):
+        core = getattr(reddit, attr, None)
+        if core is not None and hasattr(core, "_rate_limiter"):
+            core._rate_limiter = _UnpacedRateLimiter(window_size=reddit.config.window_size)
+    return reddit
 
-    subreddit_scores = defaultdict(int)
-    subreddit_details = {}
 
-    for keyword in keywords:
+class RedditClientPool:
+    """
+    Thread-safe pool of authenticated praw.Reddit clients.
+
+    A praw.Reddit instance should not be used by two threads at once, so callers
+    borrow a client for the duration of their work and hand it back afterwards.
+    Clients are created lazily up to `size` and keep their HTTP session and OAuth
+    token between calls; tokens close to expiry are refreshed on checkout.
+
+    A borrowed client is held while its request waits in the RequestScheduler,
+    so checkout follows the same priority classes: waiting interactive callers
+    are served first, and background callers may hold at most
+    `size - interactive` clients. Background work stuck waiting for quota can
+    then never keep a user's request from reaching the scheduler's queue.
+    """
+
+    def __init__(self, size=CLIENT_POOL_SIZE, factory=create_reddit_client, interactive=INTERACTIVE_CLIENTS):
+        self.size = size
+        self.factory = factory
+        self.background_limit = max(1, size - interactive)
+        self._idle = []  # Used as a stack: LIFO keeps the warmest session in use
+        self._created = 0
+        self._in_use = defaultdict(int)  # priority -> clients borrowed
+        self._borrowed = {}  # id(client) -> priority it was borrowed at
+        self._waiting = defaultdict(int)  # priority -> callers waiting for a client
+        self._cond = threading.Condition()
+
+    def _can_borrow(self, priority):
+        if any(count for waiting, count in self._waiting.items() if waiting < priority):
+            return False
+        in_use = sum(self._in_use.values())
+        if priority != PRIORITY_INTERACTIVE and in_use - self._in_use[PRIORITY_INTERACTIVE] >= self.background_limit:
+            return False
+        return bool(self._idle) or self._created < self.size
+
+    def acquire(self, timeout=None, priority=None):
+        """Borrow a client, creating one if the pool is not full yet.
+
+        `priority` defaults to the request_context() priority of the caller.
+        Raises queue.Empty if no client becomes free within `timeout` seconds.
+        """
+        priority = _request_priority.get() if priority is None else priority
+        with self._cond:
+            self._waiting[priority] += 1
+            try:
+                if not self._cond.wait_for(lambda: self._can_borrow(priority), timeout=timeout):
+                    raise queue.Empty
+            finally:
+                self._waiting[priority] -= 1
+                # Lower-priority callers may have been held back only by this one
+                self._cond.notify_all()
+            self._in_use[priority] += 1
+            reddit = self._idle.pop() if self._idle else None
+            if reddit is None:
+                self._created += 1
+
+        if reddit is None:
+            try:
+                reddit = self.factory()
+            except Exception:
+                with self._cond:
+                    self._created -= 1
+                    self._in_use[priority] -= 1
+                    self._cond.notify_all()
+                raise
+        with self._cond:
+            self._borrowed[id(reddit)] = priority
+
+        self._refresh_if_expiring(reddit)
+        return reddit
+
+    def release(self, reddit):
+        """Return a borrowed client to the pool."""
+        with self._cond:
+            self._in_use[self._borrowed.pop(id(reddit))] -= 1
+            self._idle.append(reddit)
+            self._cond.notify_all()
+
+    @contextmanager
+    def client(self, timeout=None):
+        """Context manager that borrows a client and always returns it."""
+        reddit = self.acquire(timeout=timeout)
+        try:
+            yield reddit
+        finally:
+            self.release(reddit)
+
+    @staticmethod
+    def _refresh_if_expiring(reddit):
+        authorizer = getattr(getattr(reddit, "_core", None), "_authorizer", None)
+        expires_at_ns = getattr(authorizer, "_expiration_timestamp_ns", None)
+        if authorizer is None or authorizer.access_token is None or expires_at_ns is None:
+            return  # No token yet, prawcore fetches one on the first request
+        if expires_at_ns - time.monotonic_ns() < TOKEN_REFRESH_MARGIN * 1_000_000_000:
+            try:
+                authorizer.refresh()
+            except Exception as e:
+                # prawcore will retry the refresh itself on the next request
+                print(f"Error refreshing Reddit token: {e}")
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_client_pool():
+    """Return the process-wide client pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = RedditClientPool()
+    return _pool
+
+
+def reddit_client(timeout=None):
+    """Borrow an authenticated client from the shared pool (use as a `with` block)."""
+    return get_client_pool().client(timeout=timeout)
+
+
+### CACHE ###
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Return the process-wide Reddit response cache, opening it on first use."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = TTLCache()
+    return _cache
+
+
+### CATALOG ###
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog():
+    """Return the process-wide subreddit catalog, loading it and starting its refresher on first use."""
+    global _catalog
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                catalog = SubredditCatalog()
+                if CATALOG_REFRESH_INTERVAL > 0:
+                    catalog.start_refresher(_fetch_subreddit_metadata)
+                _catalog = catalog
+    return _catalog
+
+
+def _fetch_subreddit_metadata(name):
+    """Fetch the current metadata of one subreddit (about + rules), or None on error."""
+    try:
+        with reddit_client() as reddit:
+            subreddit = reddit.subreddit(name)
+            return {
+                "name": subreddit.display_name,
+                "description": subreddit.public_description or "",
+                "subscribers": subreddit.subscribers or 0,
+                "user_is_banned": bool(subreddit.user_is_banned),
+                "rules_count": len(list(subreddit.rules)),
+            }
+    except Exception as e:
+        print(f"Error refreshing r/{name}: {e}")
+        return None
+
+
+def _run_parallel(func, items, max_workers):
+    """Apply `func` to every item, in parallel when allowed, keeping input order."""
+    if max_workers > 1 and len(items) > 1:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+            # Each task runs in a copy of the caller's context to keep its request tags
+            futures = [executor.submit(contextvars.copy_context().run, func, item) for item in items]
+            return [future.result() for future in futures]
+    return [func(item) for item in items]
+
+
+def _search_keyword(keyword, search_limit):
+    """Cached wrapper around _search_keyword_live. Returns fresh dicts the caller may modify."""
+    candidates = get_cache().get_or_load(
+        "search", [keyword.lower(), search_limit],
+        lambda: _search_keyword_live(keyword, search_limit),
+        ttl=SEARCH_CACHE_TTL, stale_ttl=CACHE_STALE_TTL)
+    return None if candidates is None else [dict(candidate) for candidate in candidates]
+
+
+def _cached_search(keyword, search_limit):
+    """Fresh cached results of a keyword search (copies), or None; never calls Reddit."""
+    candidates = get_cache().get("search", [keyword.lower(), search_limit], ttl=SEARCH_CACHE_TTL)
+    return None if candidates is None else [dict(candidate) for candidate in candidates]
+
+
+def _search_keyword_live(keyword, search_limit):
+    """Run one subreddit search and return the listing metadata of each result.
+
+    Only fields that come back in the search listing are read, so this costs a
+    single request however many subreddits are returned.
+    """
+    candidates = []
+    with reddit_client() as reddit:
         try:
             search_results = reddit.subreddits.search(
                 keyword, limit=search_limit)
             for subreddit in search_results:
-                try:
-                    if subreddit.user_is_banned or len(list(subreddit.rules)) == 0 or subreddit.subscribers < 1000:
-                        print("Skipping banned subreddit: " +
-                              subreddit.display_name)
-                        continue
-                    
-                    print("Found subreddit: " + subreddit.display_name)
-
-                    content = (
-                        f"{subreddit.display_name} {subreddit.public_description}"
-                    ).lower()
-                    subreddit_details[subreddit.display_name] = {
-                        "description": subreddit.public_description
-                    }
-
-                    # Count keyword occurrences
-                    keyword_matches = sum(
-                        1 for k in keywords if k.lower() in content)
-                    if keyword_matches > 0:
-                        subreddit_scores[subreddit.display_name] += keyword_matches
-                except Exception as e:
-                    # Skip subreddits where submission check fails
-                    print(e)
-                    continue
-
-        except Exception as e:  
+                candidates.append({
+                    "name": subreddit.display_name,
+                    "description": subreddit.public_description or "",
+                    "subscribers": subreddit.subscribers or 0,
+                    "user_is_banned": bool(subreddit.user_is_banned),
+                })
+        except Exception as e:
             print(f"Error searching for '{keyword}': {e}")
+            return None  # Don't cache a failed search
+
+    return candidates
+
+
+def _get_rules_count(candidate):
+    """Rules count of a candidate, from the catalog or metadata cache when possible."""
+    if candidate.get("rules_count") is not None:
+        return candidate["rules_count"]
+
+    def load():
+        rules_count = _fetch_rules_count(candidate["name"])
+        if rules_count is None:
+            return None
+        return {**candidate, "rules_count": rules_count}
+
+    metadata = get_cache().get_or_load(
+        "subreddit", candidate["name"].lower(), load,
+        ttl=METADATA_CACHE_TTL, stale_ttl=CACHE_STALE_TTL)
+    return metadata["rules_count"] if metadata else None
+
+
+def _fetch_rules_count(name):
+    """Fetch the number of rules of a subreddit (one request), or None on error."""
+    try:
+        with reddit_client() as reddit:
+            return len(list(reddit.subreddit(name).rules))
+    except Exception as e:
+        # Skip subreddits where the rules check fails
+        print(e)
+        return None
+
+
+def _passes_vetting(entry):
+    """True for a catalog entry that _vet_candidates has already checked and kept."""
+    return (not entry["user_is_banned"] and entry["subscribers"] >= MIN_SUBSCRIBERS
+            and bool(entry["rules_count"]))
+
+
+def _vet_candidates(candidates, max_workers):
+    """
+    Drop banned, small and rule-less subreddits.
+
+    The ban and subscriber checks use the listing data we already have, so the
+    rules are only fetched (once per name) for subreddits that pass them.
+
+    Returns:
+        list: The candidates that passed, in their original order.
+    """
+    remaining = []
+    for candidate in candidates:
+        if candidate["user_is_banned"] or candidate["subscribers"] < MIN_SUBSCRIBERS:
+            print("Skipping banned subreddit: " + candidate["name"])
+            continue
+        remaining.append(candidate)
+
+    rules_counts = _run_parallel(_get_rules_count, remaining, max_workers)
 
-    # Sort subreddits by score in descending order
-    sorted_subreddits = sorted(
-        subreddit_scores.items(),
-        key=lambda x: x[1],
-        reverse=True
-    )
+    vetted = []
+    for candidate, rules_count in zip(remaining, rules_counts):
+        if rules_count is None:
+            continue
+        candidate["rules_count"] = rules_count
+        if rules_count == 0:
+            print("Skipping banned subreddit: " + candidate["name"])
+            continue
+        print("Found subreddit: " + candidate["name"])
+        vetted.append(candidate)
+
+    return vetted
+
+
+def get_relevant_subreddits(keywords, search_limit=100, max_workers=SEARCH_CONCURRENCY):
+    """
+    Search Reddit for each keyword and rank the subreddits that come back.
+
+    See _discover_subreddits.
+
+    Returns:
+        list: [(subreddit name, BM25 score), ...] sorted by score, highest first.
+    """
+    ranked, _ = _discover_subreddits(keywords, search_limit, max_workers)
+    return ranked
+
+
+def _discover_subreddits(keywords, search_limit, max_workers):
+    """
+    Find, vet and rank the subreddits matching the keywords.
+
+    Keywords with at least CATALOG_MIN_HITS matches in the local subreddit catalog
+    are answered from it; only the rest are searched on Reddit. A catalog match
+    must contain every word of the keyword and must already have passed vetting.
+    Keywords searched recently are answered from the search cache instead,
+    which is exact where the catalog is only an approximation.
+    Candidates are deduplicated across all keyword searches before vetting, so
+    each subreddit costs at most one extra request (its rules) however many
+    keywords return it. Use get_request_count() to check the request total.
+
+    Args:
+        keywords (list): Keywords to search for.
+        search_limit (int): Max subreddits returned per keyword search.
+        max_workers (int): How many Reddit requests to run in parallel.
+            Use 1 to run everything serially.
 
+    Returns:
+        tuple: ([(subreddit name, BM25 score), ...] sorted by score, highest
+               first; {subreddit name: description} of the vetted subreddits).
+    """
+    catalog = get_catalog()
+
+    # Answer from recent searches, then the local catalog, searching live only where it is thin
+    per_keyword = []
+    live_keywords = []
+    for keyword in keywords:
+        hits = _cached_search(keyword, search_limit)
+        if hits is None:
+            hits = catalog.search(keyword, limit=search_limit, match_all=True, accept=_passes_vetting)
+            if len(hits) < CATALOG_MIN_HITS:
+                live_keywords.append(keyword)
+        per_keyword.append(hits)
+    live_results = dict(zip(live_keywords, _run_parallel(
+        lambda keyword: _search_keyword(keyword, search_limit) or [], live_keywords, max_workers)))
+    per_keyword = [
+        live_results.get(keyword, hits) for keyword, hits in zip(keywords, per_keyword)
+    ]
+
+    # Dedupe across keywords, remembering how many searches returned each subreddit
+    candidates = {}
+    search_hits = defaultdict(int)
+    for results in per_keyword:
+        for candidate in results:
+            candidates.setdefault(candidate["name"], candidate)
+            search_hits[candidate["name"]] += 1
+
+    vetted = _vet_candidates(list(candidates.values()), max_workers)
+
+    for keyword in live_keywords:
+        for candidate in live_results[keyword]:
+            catalog.upsert(candidate)
+    try:
+        catalog.save()
+    except Exception as e:
+        # The catalog is only a cache; the next discovery call saves again
+        print(f"Error saving subreddit catalog: {e}")
+
+    # BM25 over names and descriptions, boosted by how many searches returned each one
+    descriptions = {candidate["name"]: candidate["description"] for candidate in vetted}
+    return rank_subreddits(keywords, descriptions, boosts=search_hits), descriptions
+
+
+def suggest_subreddits(keywords, search_limit=100, top_k=RERANK_TOP_K, max_workers=SEARCH_CONCURRENCY):
+    """
+    Find relevant subreddits and return only the best `top_k`, re-ranked locally.
+
+    Runs the same discovery as get_relevant_subreddits and then re-scores its
+    results by hashed TF-IDF similarity between the keywords and each
+    subreddit's name and description, so the LLM only has to present a short,
+    already ordered list.
 
-    return sorted_subreddits
+    Returns:
+        list: [(subreddit name, score), ...], at most `top_k` long, best first.
+    """
+    ranked, descriptions = _discover_subreddits(keywords, search_limit, max_workers)
+    suggested = rerank_subreddits(keywords, ranked, descriptions, top_k=top_k)
+    # The user will most likely read one of the best few next, so start fetching their posts
+    get_prefetcher().prefetch(_request_session.get(), [name for name, _ in suggested], _request_query.get())
+    return suggested
 
 
 def post_to_reddit(subreddit, title, content):
-    client_id = os.getenv("CLIENT_ID")
-    client_secret = os.getenv("CLIENT_SECRET")
-    username = os.getenv("USERNAME")  
-    password = os.getenv("PASSWORD")  
-    user_agent = "ToastyPostyBot/1.0 by u/One-Cap-3906"
-
-    reddit = praw.Reddit(
-        client_id=client_id,
-        client_secret=client_secret,
-        username=username,
-        password=password,
-        user_agent=user_agent
-    )
-
-    subreddit = reddit.subreddit(subreddit)
-    title = title
-    content = content
-
-    submission = subreddit.submit(title=title, selftext=content)
+    with request_context(priority=PRIORITY_INTERACTIVE), reddit_client() as reddit:
+        subreddit = reddit.subreddit(subreddit)
+        title = title
+        content = content
+
+        submission = subreddit.submit(title=title, selftext=content)
     print(f"Post submitted! URL: {submission.url}")
     return submission.url
 
 
+### POST QUEUE ###
+_post_queue = None
+_post_queue_lock = threading.Lock()
+
+
+def _is_transient_post_error(error):
+    """True for submission errors worth retrying (network, 5xx, 429, Reddit's posting rate limit)."""
+    if isinstance(error, (prawcore.exceptions.RequestException, prawcore.exceptions.ServerError,
+                          prawcore.exceptions.TooManyRequests)):
+        return True
+    from praw.exceptions import RedditAPIException
+
+    if isinstance(error, RedditAPIException):
+        return any(item.error_type == "RATELIMIT" for item in error.items)
+    return False
+
+
+def get_post_queue():
+    """Return the process-wide post submission queue, starting its workers on first use."""
+    global _post_queue
+    if _post_queue is None:
+        with _post_queue_lock:
+            if _post_queue is None:
+                post_queue = PostQueue(post_to_reddit, _is_transient_post_error)
+                post_queue.start()
+                _post_queue = post_queue
+    return _post_queue
+
+
+def queue_posts(subreddits, title, content, wait=POST_WAIT_TIMEOUT):
+    """
+    Submit one title/body to several subreddits in the background.
+
+    Posts are submitted concurrently (within the shared rate limit), retried on
+    transient errors, and never posted twice with the same title to the same
+    subreddit. Waits up to `wait` seconds for them to be submitted, so the
+    caller usually gets the post URLs right away; jobs still queued after that
+    (e.g. waiting out Reddit's posting rate limit) keep going in the background.
+
+    Args:
+        subreddits (list): Subreddit names (with or without "r/").
+        title (str): Post title.
+        content (str): Post body.
+        wait (float): Seconds to wait for the submissions, 0 returns immediately.
+
+    Returns:
+        list: One job handle per subreddit ({"id", "subreddit", "title",
+              "status", "attempts", "url", "error"}); poll get_post_status()
+              for jobs not yet submitted or failed.
+    """
+    post_queue = get_post_queue()
+    jobs = post_queue.enqueue(subreddits, title, content)
+    if wait:
+        jobs = post_queue.wait([job["id"] for job in jobs], timeout=wait)
+    return jobs
+
+
+def get_post_status(job_ids):
+    """Current job handles for `job_ids`, as returned by queue_posts()."""
+    return get_post_queue().status(job_ids)
+
+
 # def search_subreddit(subreddit_name, query, limit=10):
 #     client_id = os.getenv("CLIENT_ID")
 #     client_secret = os.getenv("CLIENT_SECRET")
@@ -189,49 +839,178 @@ def post_to_reddit(subreddit, title, content):
 #     )
 #     return response.choices[0].text.strip()
 
-def fetch_comments_for_query(subreddit_name, query, post_limit=5, comment_limit=5):
+def fetch_comments_for_query(subreddit_name, query, post_limit=5, comment_limit=5,
+                             max_workers=COMMENT_CONCURRENCY):
     """
     Search for posts matching a query in a subreddit, and fetch top comments.
-    
+
+    The comment listings of all matched posts are fetched in parallel. Posts
+    prefetched for this session's question (see get_prefetcher) are served first.
+    Returns fresh dicts the caller may modify.
+
     Args:
         subreddit_name (str): The subreddit to search in.
         query (str): The query to search for.
         post_limit (int): The number of posts to retrieve.
         comment_limit (int): The number of top comments to retrieve per post.
+        max_workers (int): How many posts to fetch comments for at once.
+            Use 1 to fetch them one after another.
 
     Returns:
         list: A list of dictionaries, each containing:
+              - "id": Post id (its permalink is https://redd.it/<id>)
               - "title": Post title
-              - "url": Post URL
+              - "url": Post URL (the linked page, for link posts)
               - "comments": List of top comments
     """
-    reddit = praw.Reddit(
-        client_id=os.getenv("CLIENT_ID"),
-        client_secret=os.getenv("CLIENT_SECRET"),
-        username=os.getenv("USERNAME"),
-        password=os.getenv("PASSWORD"),
-        user_agent="ToastyPostyBot/1.0 by u/One-Cap-3906"
-    )
-    subreddit = reddit.subreddit(subreddit_name)
+    prefetched = get_prefetcher().get(_request_session.get(), subreddit_name, query, post_limit, comment_limit)
+    if prefetched is not None:
+        return prefetched
+    posts = get_cache().get_or_load(
+        "comments", [subreddit_name.lower(), query, post_limit, comment_limit],
+        lambda: _fetch_comments_live(subreddit_name, query, post_limit, comment_limit, max_workers),
+        ttl=COMMENTS_CACHE_TTL, stale_ttl=CACHE_STALE_TTL,
+        # Nobody waits on revalidating a stale entry, so it yields to requests a user is waiting on
+        refresh_loader=lambda: _fetch_comments_live(subreddit_name, query, post_limit, comment_limit, max_workers,
+                                                    priority=PRIORITY_BACKGROUND))
+    return _copy_posts(posts)
+
+
+def _copy_posts(posts):
+    """Copies of cached post dicts, so callers can't change what later cache hits return."""
+    return [{**post, "comments": list(post["comments"])} for post in posts]
+
+
+class PostComments(namedtuple("PostComments", ["id", "title", "url", "comments"])):
+    """Compact record of one post and a tuple of its top comment bodies."""
+
+    __slots__ = ()
+
+    def as_dict(self):
+        return {
+            "id": self.id,
+            "title": self.title,
+            "url": self.url,
+            "comments": list(self.comments)
+        }
+
+
+def _fetch_post_comments(post, comment_limit, priority=PRIORITY_INTERACTIVE):
+    """
+    Fetch the top comments of one search result, or None if that fails.
+
+    Reddit is asked for only `comment_limit` top-level comments (sorted by
+    COMMENT_SORT, replies excluded), and the bodies are read straight from the
+    JSON response instead of building a praw object for every comment.
+    """
+    try:
+        with request_context(priority=priority), reddit_client() as reddit:
+            _, comment_listing = reddit.request(
+                method="GET", path=f"comments/{post['id']}/",
+                params={"limit": comment_limit, "sort": COMMENT_SORT, "depth": 1, "raw_json": 1})
+        top_comments = tuple(
+            child["data"]["body"] for child in comment_listing["data"]["children"]
+            if child["kind"] == "t1"  # Skip "load more comments" stubs
+        )[:comment_limit]
+        return PostComments(post["id"], post["title"], post["url"], top_comments)
+    except Exception as e:
+        print(f"Error fetching comments for post '{post['title']}': {e}")
+        return None
+
+
+def _search_posts(subreddit_name, query, post_limit, priority=PRIORITY_INTERACTIVE):
+    """Search posts matching the query in a subreddit (a single listing request)."""
     print(f"Searching '{query}' in r/{subreddit_name}...")
+    with request_context(priority=priority), reddit_client() as reddit:
+        subreddit = reddit.subreddit(subreddit_name)
+        return [
+            {"id": submission.id, "title": submission.title, "url": submission.url}
+            for submission in subreddit.search(query, limit=post_limit)
+        ]
+
+
+def _iter_post_comments(posts, comment_limit, max_workers, priority=PRIORITY_INTERACTIVE):
+    """Yield (position, PostComments) for each post as soon as its comments arrive."""
+    if not posts:
+        return
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(posts))))
+    try:
+        futures = {
+            executor.submit(contextvars.copy_context().run, _fetch_post_comments, post, comment_limit,
+                            priority): position
+            for position, post in enumerate(posts)
+        }
+        for future in as_completed(futures):
+            record = future.result()
+            if record is not None:
+                yield futures[future], record
+    finally:
+        # Don't start the remaining fetches if the consumer stopped early
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _fetch_comments_live(subreddit_name, query, post_limit, comment_limit, max_workers=COMMENT_CONCURRENCY,
+                         priority=PRIORITY_INTERACTIVE):
+    posts = _search_posts(subreddit_name, query, post_limit, priority)
+    results = sorted(_iter_post_comments(posts, comment_limit, max_workers, priority))
+    return [record.as_dict() for _, record in results]
+
+
+### PREFETCH ###
+_prefetcher = None
+_prefetcher_lock = threading.Lock()
+
+
+def _prefetch_comments(subreddit_name, query, post_limit, comment_limit):
+    # Speculative, so it yields to requests a user is waiting on
+    return _fetch_comments_live(subreddit_name, query, post_limit, comment_limit,
+                                priority=PRIORITY_BACKGROUND)
+
+
+def get_prefetcher():
+    """Return the process-wide PrefetchCache used by suggest_subreddits and the comment lookups."""
+    global _prefetcher
+    if _prefetcher is None:
+        with _prefetcher_lock:
+            if _prefetcher is None:
+                _prefetcher = PrefetchCache(_prefetch_comments)
+    return _prefetcher
+
+
+def get_prefetch_stats():
+    """Prefetched subreddits, comment lookups and how many of them prefetching answered."""
+    return get_prefetcher().stats()
+
+
+def iter_comments_for_query(subreddit_name, query, post_limit=5, comment_limit=5,
+                            max_workers=COMMENT_CONCURRENCY):
+    """
+    Streaming version of fetch_comments_for_query.
 
-    results = []
+    Yields each post's {"id", "title", "url", "comments"} dict as soon as its comments
+    have been fetched, so callers can show results while the rest are loading.
+    Posts arrive in completion order rather than search order. Prefetched or
+    cached results are replayed at once; a completed live fetch is stored in the same cache
+    entry fetch_comments_for_query uses.
+    """
+    prefetched = get_prefetcher().get(_request_session.get(), subreddit_name, query, post_limit, comment_limit)
+    if prefetched is not None:
+        yield from prefetched
+        return
 
-    # Search posts matching the query
-    for submission in subreddit.search(query, limit=post_limit):
-        try:
-            submission.comments.replace_more(limit=0)  # Load all top-level comments
-            top_comments = [comment.body for comment in submission.comments[:comment_limit]]
-            results.append({
-                "title": submission.title,
-                "url": submission.url,
-                "comments": top_comments
-            })
-        except Exception as e:
-            print(f"Error fetching comments for post '{submission.title}': {e}")
-            continue
+    cache_key = [subreddit_name.lower(), query, post_limit, comment_limit]
+    cached = get_cache().get("comments", cache_key, ttl=COMMENTS_CACHE_TTL)
+    if cached is not None:
+        yield from _copy_posts(cached)
+        return
+
+    results = []
+    posts = _search_posts(subreddit_name, query, post_limit)
+    for position, record in _iter_post_comments(posts, comment_limit, max_workers):
+        results.append((position, record))
+        yield record.as_dict()
 
-    return results
+    get_cache().set("comments", cache_key, [record.as_dict() for _, record in sorted(results)])
 
 #print(get_relevant_subreddits(['travel', 'rewards', 'bonuses'], search_limit=20))
 #print(post_to_reddit("TravelHacks", "test title", "test content"))
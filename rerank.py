@@ -0,0 +1,92 @@
+import zlib
+
+from ranking import subreddit_tokens, tokenize
+
+
+### CONSTANTS ###
+HASH_DIM = 2 ** 18  # Hashed feature space; only the columns actually used are materialized
+RERANK_TOP_K = 5  # Subreddits handed to the LLM after re-ranking
+RERANK_BLEND = 0.6  # Weight of the cosine similarity vs. the normalized BM25 score
+
+
+def _hash_token(token):
+    return zlib.crc32(token.encode("utf-8")) % HASH_DIM
+
+
+def tfidf_matrices(query_tokens, doc_tokens):
+    """
+    Build L2-normalized hashed TF-IDF matrices for queries and documents.
+
+    Tokens are hashed into HASH_DIM buckets and the buckets that occur anywhere
+    are compacted into a dense column range, so the matrices stay small no
+    matter how large HASH_DIM is. IDF is fitted on the documents.
+
+    Args:
+        query_tokens (list): One token list per query.
+        doc_tokens (list): One token list per document.
+
+    Returns:
+        tuple: (queries, docs) float32 arrays of shape (n_queries, n_features)
+               and (n_docs, n_features).
+    """
+    import numpy as np  # Deferred: only needed once subreddits are ranked, not at startup
+
+    token_lists = list(query_tokens) + list(doc_tokens)
+    rows = np.repeat(np.arange(len(token_lists)), [len(tokens) for tokens in token_lists])
+    buckets = np.fromiter((_hash_token(token) for tokens in token_lists for token in tokens),
+                          dtype=np.int64, count=len(rows))
+    _, cols = np.unique(buckets, return_inverse=True)
+
+    counts = np.zeros((len(token_lists), cols.max() + 1 if len(cols) else 1), dtype=np.float32)
+    np.add.at(counts, (rows, cols), 1)
+
+    queries, docs = counts[:len(query_tokens)], counts[len(query_tokens):]
+    doc_frequency = (docs > 0).sum(axis=0)
+    idf = np.log((1 + len(docs)) / (1 + doc_frequency)) + 1
+
+    def weigh(matrix):
+        weighted = np.log1p(matrix) * idf
+        norms = np.linalg.norm(weighted, axis=1, keepdims=True)
+        return weighted / np.where(norms == 0, 1, norms)
+
+    return weigh(queries), weigh(docs)
+
+
+def rerank_subreddits(keywords, ranked, descriptions, top_k=RERANK_TOP_K, blend=RERANK_BLEND):
+    """
+    Re-rank BM25 results by semantic similarity to the keywords and keep the top k.
+
+    Every keyword is embedded as its own query; the cosine similarities of all
+    keywords against all subreddits come from one matrix product and are
+    averaged, then blended with the (max-normalized) BM25 score.
+
+    Args:
+        keywords (list): Keywords used for the search.
+        ranked (list): [(subreddit name, score), ...] from get_relevant_subreddits.
+        descriptions (dict): {subreddit name: description}.
+        top_k (int): How many subreddits to return.
+        blend (float): Weight of the semantic score, between 0 and 1.
+
+    Returns:
+        list: [(subreddit name, score), ...], at most `top_k` long, best first.
+    """
+    if not ranked or not keywords:
+        return list(ranked)[:top_k]
+
+    import numpy as np
+
+    names = [name for name, _ in ranked]
+    queries, docs = tfidf_matrices(
+        [tokenize(keyword) for keyword in keywords],
+        [subreddit_tokens(name, descriptions.get(name, "")) for name in names])
+
+    semantic = (queries @ docs.T).mean(axis=0)
+    if semantic.max() > 0:
+        semantic /= semantic.max()
+    lexical = np.array([score for _, score in ranked], dtype=np.float32)
+    if lexical.max() > 0:
+        lexical /= lexical.max()
+
+    combined = blend * semantic + (1 - blend) * lexical
+    order = np.argsort(-combined, kind="stable")[:top_k]
+    return [(names[i], round(float(combined[i]), 3)) for i in order]
@@ -0,0 +1,129 @@
+import re
+
+from context_budget import count_tokens
+
+
+### CONSTANTS ###
+MAX_TITLE_CHARS = 150  # Post titles are cut to this length
+MAX_COMMENT_CHARS = 400  # Each comment is cut to this length
+MAX_COMMENTS_PER_POST = 5  # Comments kept per post after deduplication
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_MARKDOWN_LINK_RE = re.compile(r"\[([^\]]*)\]\([^)]*\)")
+_REDDIT_POST_RE = re.compile(r"https?://(?:www\.|old\.)?reddit\.com/r/[^/]+/comments/([a-z0-9]+)", re.I)
+
+
+def _clean(text, max_chars):
+    """Collapse whitespace, drop markdown link targets and cut to `max_chars`."""
+    text = _WHITESPACE_RE.sub(" ", _MARKDOWN_LINK_RE.sub(r"\1", text or "")).strip()
+    if len(text) > max_chars:
+        text = text[:max_chars - 1].rstrip() + "…"
+    return text
+
+
+def _short_url(url):
+    """Reddit post URLs become redd.it short links; others are kept whole (a cut URL is a broken one)."""
+    match = _REDDIT_POST_RE.match(url or "")
+    if match:
+        return f"https://redd.it/{match.group(1)}"
+    return url or ""
+
+
+def _post_link(post):
+    """The post's own redd.it permalink, also for link posts whose "url" points elsewhere."""
+    if post.get("id"):
+        return f"https://redd.it/{post['id']}"
+    return _short_url(post["url"])  # Records cached before posts carried their id
+
+
+def serialize_subreddits(ranked):
+    """
+    Compact text form of [(subreddit name, score), ...].
+
+    Format (one subreddit per line, best first):
+        subreddits (name score):
+        r/AwardTravel 1.0
+    """
+    lines = ["subreddits (name score):"]
+    lines += [f"r/{name} {round(score, 3):g}" for name, score in ranked]
+    return "\n".join(lines)
+
+
+def serialize_posts(posts, max_comments=MAX_COMMENTS_PER_POST, max_comment_chars=MAX_COMMENT_CHARS):
+    """
+    Compact text form of fetch_comments_for_query results.
+
+    Titles and comments are whitespace-collapsed and length-capped, each post is
+    linked by its redd.it permalink, and comments repeated within or across
+    posts are dropped.
+
+    Format:
+        posts (title | url, then one comment per line):
+        1. Best travel card? | https://redd.it/abc123
+        - First comment
+        - Second comment
+    """
+    seen = set()
+    lines = ["posts (title | url, then one comment per line):"]
+    for number, post in enumerate(posts, 1):
+        lines.append(f"{number}. {_clean(post['title'], MAX_TITLE_CHARS)} | {_post_link(post)}")
+        kept = 0
+        for comment in post["comments"]:
+            text = _clean(comment, max_comment_chars)
+            key = text.lower()
+            if not text or key in seen or text in ("[deleted]", "[removed]"):
+                continue
+            seen.add(key)
+            lines.append(f"- {text}")
+            kept += 1
+            if kept >= max_comments:
+                break
+    return "\n".join(lines)
+
+
+def serialize_post_jobs(jobs):
+    """
+    Compact text form of post job handles (see reddit.queue_posts).
+
+    Format (one job per line; the last field is the post URL once submitted,
+    the error once failed):
+        post jobs (id subreddit status url/error):
+        3f9c2a1b7d04 r/AwardTravel submitted https://redd.it/abc123
+    """
+    lines = ["post jobs (id subreddit status url/error):"]
+    for job in jobs:
+        detail = _short_url(job["url"]) if job["url"] else _clean(job["error"], MAX_COMMENT_CHARS)
+        lines.append(f"{job['id']} r/{job['subreddit']} {job['status']} {detail}".rstrip())
+    return "\n".join(lines)
+
+
+def serialize_tool_output(tool_name, output):
+    """Compact, LLM-facing form of a tool's output (falls back to str for other tools)."""
+    try:
+        if tool_name == "grab_subreddits":
+            return serialize_subreddits(output)
+        if tool_name == "fetch_comments":
+            return serialize_posts(output)
+        if tool_name in ("post_to_subreddit", "check_post_status"):
+            return serialize_post_jobs(output)
+    except (TypeError, KeyError, ValueError):
+        pass  # Unexpected shape, send it as-is
+    return str(output)
+
+
+def serialize_tool_result(tool_result):
+    """Content of the ToolMessage for a tool_executor.ToolResult."""
+    if tool_result.error:
+        return tool_result.content
+    return serialize_tool_output(tool_result.name, tool_result.output)
+
+
+def payload_stats(output, compact):
+    """Bytes and tokens of the Python repr of `output` vs. its compact form."""
+    raw = str(output)
+    return {
+        "repr_bytes": len(raw.encode("utf-8")),
+        "compact_bytes": len(compact.encode("utf-8")),
+        "repr_tokens": count_tokens(raw),
+        "compact_tokens": count_tokens(compact),
+    }
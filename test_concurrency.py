@@ -0,0 +1,273 @@
+"""
+Tests of the shared concurrency machinery: the worker pool, the Reddit request
+scheduler and client pool, and the post queue. No network access is needed.
+
+    python -m pytest -q test_concurrency.py
+"""
+import queue
+import threading
+import time
+
+import pytest
+
+import post_queue
+from post_queue import PostQueue
+from reddit import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, RedditClientPool, RequestScheduler
+from worker_pool import PoolBusy, WorkerPool
+
+
+### HELPERS ###
+def wait_until(condition, timeout=5):
+    """Poll `condition` until it is true; fail the test if it never is."""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out waiting for condition"
+        time.sleep(0.005)
+
+
+def start_thread(target, *args):
+    thread = threading.Thread(target=target, args=args, daemon=True)
+    thread.start()
+    return thread
+
+
+### WORKER POOL ###
+def test_pool_session_cap_and_capacity_raise_pool_busy():
+    pool = WorkerPool(max_workers=2, max_pending=0, per_session=1)
+    release = threading.Event()
+    try:
+        pool.submit(release.wait, session="a")
+        with pytest.raises(PoolBusy):
+            pool.submit(release.wait, session="a", timeout=0)  # Session "a" has used its share
+
+        pool.submit(release.wait, session="b")
+        with pytest.raises(PoolBusy):
+            pool.submit(release.wait, session="c", timeout=0)  # The pool itself is full
+        assert pool.stats()["rejected"] == 2
+    finally:
+        release.set()
+
+    wait_until(lambda: not pool.stats()["sessions"])
+    assert pool.submit(lambda: "ok", session="a", timeout=0).result(timeout=5) == "ok"
+
+
+def test_pool_submit_waits_for_room():
+    pool = WorkerPool(max_workers=1, max_pending=0, per_session=1)
+    pool.submit(time.sleep, 0.1)
+    job = pool.submit(lambda: "ok", timeout=5)  # Blocks until the first job is done
+    assert job.result(timeout=5) == "ok"
+
+
+def test_iterate_reraises_and_releases_its_slot():
+    pool = WorkerPool(max_workers=1, max_pending=0, per_session=1)
+
+    def failing():
+        yield 1
+        raise ValueError("boom")
+
+    items = []
+    with pytest.raises(ValueError, match="boom"):
+        for item in pool.iterate(failing, session="a"):
+            items.append(item)
+    assert items == [1]
+
+    wait_until(lambda: not pool.stats()["sessions"])
+    assert pool.submit(lambda: "ok", session="a", timeout=0).result(timeout=5) == "ok"
+
+
+def test_iterate_early_close_stops_the_worker():
+    pool = WorkerPool(max_workers=1, max_pending=0, per_session=1)
+    produced = []
+
+    def endless():
+        for n in range(10_000_000):
+            produced.append(n)
+            yield n
+
+    stream = pool.iterate(endless, session="a")
+    assert next(stream) == 0
+    stream.close()
+
+    wait_until(lambda: not pool.stats()["sessions"])
+    assert len(produced) < 10_000_000
+    assert pool.submit(lambda: "ok", session="a", timeout=0).result(timeout=5) == "ok"
+
+
+def test_cancel_session_cancels_only_queued_jobs():
+    pool = WorkerPool(max_workers=1, max_pending=2, per_session=3)
+    release = threading.Event()
+    running = pool.submit(release.wait, session="a")
+    wait_until(lambda: pool.stats()["running"] == 1)
+    queued = pool.submit(lambda: "never", session="a")
+
+    assert pool.cancel_session("a") == 1
+    assert queued.future.cancelled()
+    release.set()
+    assert running.result(timeout=5) is True
+
+
+### CLIENT POOL ###
+def test_client_pool_keeps_a_client_for_interactive_callers():
+    pool = RedditClientPool(size=2, factory=object, interactive=1)
+    pool.acquire(priority=PRIORITY_BACKGROUND)
+    with pytest.raises(queue.Empty):
+        pool.acquire(timeout=0.05, priority=PRIORITY_BACKGROUND)  # Background may hold only size - 1
+
+    start = time.monotonic()
+    pool.acquire(timeout=1, priority=PRIORITY_INTERACTIVE)
+    assert time.monotonic() - start < 0.5
+
+
+def test_client_pool_serves_waiting_interactive_callers_first():
+    pool = RedditClientPool(size=2, factory=object, interactive=0)
+    held = [pool.acquire(priority=PRIORITY_BACKGROUND) for _ in range(2)]
+    served = []
+
+    def borrow(priority):
+        pool.acquire(timeout=5, priority=priority)
+        served.append(priority)
+
+    background = start_thread(borrow, PRIORITY_BACKGROUND)
+    wait_until(lambda: pool._waiting[PRIORITY_BACKGROUND] == 1)
+    interactive = start_thread(borrow, PRIORITY_INTERACTIVE)
+    wait_until(lambda: pool._waiting[PRIORITY_INTERACTIVE] == 1)
+
+    pool.release(held[0])
+    interactive.join(timeout=5)
+    assert served == [PRIORITY_INTERACTIVE]
+
+    pool.release(held[1])
+    background.join(timeout=5)
+    assert served == [PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND]
+
+
+def test_client_pool_recovers_from_a_failing_factory():
+    calls = []
+
+    def factory():
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError("auth failed")
+        return object()
+
+    pool = RedditClientPool(size=1, factory=factory, interactive=0)
+    with pytest.raises(RuntimeError):
+        pool.acquire(timeout=1, priority=PRIORITY_BACKGROUND)
+    pool.acquire(timeout=1, priority=PRIORITY_BACKGROUND)  # The failed slot was given back
+
+
+### REQUEST SCHEDULER ###
+def queued_requests(scheduler):
+    return sum(scheduler.stats()["queue_depth"].values())
+
+
+def test_scheduler_serves_interactive_requests_first():
+    scheduler = RequestScheduler(per_minute=240, burst=1)  # One token every 0.25s
+    scheduler.acquire(priority=PRIORITY_BACKGROUND, session="warmup")  # Spend the initial token
+    served = []
+
+    def request(priority, session):
+        scheduler.acquire(priority=priority, session=session)
+        served.append(priority)
+
+    threads = [start_thread(request, PRIORITY_BACKGROUND, "batch")]
+    wait_until(lambda: queued_requests(scheduler) == 1)
+    threads.append(start_thread(request, PRIORITY_INTERACTIVE, "user"))
+    wait_until(lambda: queued_requests(scheduler) == 2)
+
+    for thread in threads:
+        thread.join(timeout=5)
+    assert served == [PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND]
+    assert scheduler.stats()["waits"][PRIORITY_INTERACTIVE]["requests"] == 1
+
+
+def test_scheduler_round_robins_sessions_within_a_priority():
+    scheduler = RequestScheduler(per_minute=240, burst=1)
+    scheduler.acquire(priority=PRIORITY_BACKGROUND, session="warmup")
+    served = []
+
+    def request(session):
+        scheduler.acquire(priority=PRIORITY_BACKGROUND, session=session)
+        served.append(session)
+
+    threads = []
+    for n, session in enumerate(["a", "a", "b"], 1):
+        threads.append(start_thread(request, session))
+        wait_until(lambda: queued_requests(scheduler) == n)
+
+    for thread in threads:
+        thread.join(timeout=5)
+    assert served == ["a", "b", "a"]
+
+
+### POST QUEUE ###
+@pytest.fixture
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(post_queue, "POST_RETRY_BASE", 0.01)
+
+
+def make_queue(submit_post, is_transient=lambda e: False, **kwargs):
+    return PostQueue(submit_post, is_transient, path=":memory:", **kwargs)
+
+
+def test_post_queue_does_not_post_twice():
+    submitted = []
+
+    def submit_post(subreddit, title, content):
+        submitted.append(subreddit)
+        return f"https://redd.it/{subreddit}"
+
+    jobs_queue = make_queue(submit_post)
+    first = jobs_queue.enqueue(["r/Python"], "Title", "Body")
+    second = jobs_queue.enqueue(["python"], " Title ", "Body")
+    assert first[0]["id"] == second[0]["id"]
+
+    jobs = jobs_queue.wait([first[0]["id"]], timeout=5)
+    assert jobs[0]["status"] == "submitted"
+    assert jobs_queue.enqueue(["Python"], "Title", "Body")[0]["status"] == "submitted"
+    assert submitted == ["Python"]
+
+
+def test_post_queue_retries_transient_errors(fast_retries):
+    attempts = []
+
+    def submit_post(subreddit, title, content):
+        attempts.append(subreddit)
+        if len(attempts) < 3:
+            raise ConnectionError("reset")
+        return "https://redd.it/abc"
+
+    jobs_queue = make_queue(submit_post, is_transient=lambda e: isinstance(e, ConnectionError))
+    job_id = jobs_queue.enqueue(["python"], "Title", "Body")[0]["id"]
+    job = jobs_queue.wait([job_id], timeout=5)[0]
+    assert (job["status"], job["attempts"], job["url"]) == ("submitted", 3, "https://redd.it/abc")
+
+
+def test_post_queue_gives_up_and_allows_a_retry(fast_retries):
+    fail = [True]
+
+    def submit_post(subreddit, title, content):
+        if fail[0]:
+            raise ConnectionError("reset")
+        return "https://redd.it/abc"
+
+    jobs_queue = make_queue(submit_post, is_transient=lambda e: True, max_attempts=2)
+    job_id = jobs_queue.enqueue(["python"], "Title", "Body")[0]["id"]
+    job = jobs_queue.wait([job_id], timeout=5)[0]
+    assert (job["status"], job["attempts"]) == ("failed", 2)
+    assert "ConnectionError" in job["error"]
+
+    # Enqueueing a failed post again queues the same job once more
+    fail[0] = False
+    assert jobs_queue.enqueue(["python"], "Title", "Body")[0]["id"] == job_id
+    assert jobs_queue.wait([job_id], timeout=5)[0]["status"] == "submitted"
+
+
+def test_post_queue_fails_permanent_errors_at_once():
+    def submit_post(subreddit, title, content):
+        raise PermissionError("banned")
+
+    jobs_queue = make_queue(submit_post)
+    job_id = jobs_queue.enqueue(["python"], "Title", "Body")[0]["id"]
+    job = jobs_queue.wait([job_id], timeout=5)[0]
+    assert (job["status"], job["attempts"]) == ("failed", 1)
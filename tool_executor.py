@@ -0,0 +1,101 @@
+import concurrent.futures
+import time
+from collections import namedtuple
+
+from instrumentation import span
+from worker_pool import PoolBusy, get_worker_pool
+
+
+### CONSTANTS ###
+TOOL_TIMEOUT = 90  # Default seconds a single tool call may take
+MAX_TOOL_ROUNDS = 3  # Tool-call -> LLM round trips allowed per user turn
+
+
+class ToolResult(namedtuple("ToolResult", ["tool_call_id", "name", "output", "error", "latency"])):
+    """Outcome of one tool call. `error` is None on success; `latency` is in seconds."""
+
+    __slots__ = ()
+
+    @property
+    def content(self):
+        """What the LLM should see for this call."""
+        return f"Error: {self.error}" if self.error else self.output
+
+
+def _run_tool(name, tool, args):
+    start = time.perf_counter()
+    with span("tool", tool=name) as tool_span:
+        try:
+            return tool(args), None, time.perf_counter() - start
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            tool_span.record_error(error)
+            return None, error, time.perf_counter() - start
+
+
+def execute_tool_calls(tool_calls, tools_by_name, timeout=TOOL_TIMEOUT, timeouts=None,
+                       inline=None, session="default"):
+    """
+    Run the tool calls of one LLM turn concurrently on the shared worker pool.
+
+    Args:
+        tool_calls (list): `tool_calls` of an AIMessage ({"name", "args", "id"}).
+        tools_by_name (dict): {tool name: LangChain tool}.
+        timeout (float): Seconds each call may take, counted from dispatch.
+        timeouts (dict): Optional per-tool overrides of `timeout`.
+        inline (dict): Optional {tool name: callable(args)} run on the calling
+            thread instead of the pool (e.g. calls that draw Streamlit elements).
+            Inline calls are not subject to the timeout.
+        session (str): Session the calls are queued for (see worker_pool).
+
+    Returns:
+        list: One ToolResult per tool call, in call order. Calls that time out
+              are cancelled if they have not started and reported as errors;
+              a call already running is left to finish in the background.
+              Calls the pool had no room for are reported as errors too.
+    """
+    inline = inline or {}
+    timeouts = timeouts or {}
+    pool = get_worker_pool()
+    start = time.perf_counter()
+
+    pending = {}
+    for position, tool_call in enumerate(tool_calls):
+        tool = tools_by_name.get(tool_call["name"])
+        if tool is not None and tool_call["name"] not in inline:
+            try:
+                pending[position] = pool.submit(_run_tool, tool_call["name"], tool.invoke, tool_call["args"],
+                                                session=session, timeout=timeouts.get(tool_call["name"], timeout))
+            except PoolBusy as e:
+                pending[position] = e
+
+    results = []
+    try:
+        for position, tool_call in enumerate(tool_calls):
+            name = tool_call["name"]
+            if name in inline:
+                output, error, latency = _run_tool(name, inline[name], tool_call["args"])
+            elif name not in tools_by_name:
+                output, error, latency = f"Unknown tool: {name}", None, 0.0
+            else:
+                tool_timeout = timeouts.get(name, timeout)
+                job = pending[position]
+                if isinstance(job, PoolBusy):
+                    output, error, latency = None, f"server busy, not run ({job})", 0.0
+                else:
+                    try:
+                        output, error, latency = job.result(
+                            timeout=max(0, start + tool_timeout - time.perf_counter()))
+                    except concurrent.futures.TimeoutError:
+                        job.cancel()
+                        output, error, latency = None, f"timed out after {tool_timeout}s", tool_timeout
+
+            print(f"Tool {name} finished in {latency:.2f}s" + (f" ({error})" if error else ""))
+            results.append(ToolResult(tool_call["id"], name, output, error, latency))
+    finally:
+        # Don't start calls whose results are no longer awaited
+        for job in pending.values():
+            if not isinstance(job, PoolBusy):
+                job.cancel()
+
+    return results
@@ -0,0 +1,176 @@
+import contextvars
+import itertools
+import os
+import queue
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+
+### CONSTANTS ###
+WORKER_POOL_SIZE = int(os.getenv("WORKER_POOL_SIZE", 16))  # Blocking calls (Reddit, OpenAI) running at once, all sessions
+WORKER_QUEUE_SIZE = int(os.getenv("WORKER_QUEUE_SIZE", 32))  # Further jobs allowed to wait for a worker
+WORKER_SESSION_LIMIT = 4  # Jobs one session may have queued or running, so no user can fill the pool
+SUBMIT_TIMEOUT = 30  # Seconds submit() waits for room before giving up with PoolBusy
+STREAM_BUFFER = 64  # Items a streamed job may produce ahead of its consumer
+
+_DONE = object()
+
+
+class PoolBusy(RuntimeError):
+    """The worker pool (or the session's share of it) stayed full for the whole submit timeout."""
+
+
+class Job:
+    """Handle of one job in the worker pool."""
+
+    def __init__(self, job_id, session, future):
+        self.id = job_id
+        self.session = session
+        self.future = future
+
+    def result(self, timeout=None):
+        return self.future.result(timeout=timeout)
+
+    def done(self):
+        return self.future.done()
+
+    def cancel(self):
+        """Cancel the job if it has not started yet; a running job is left to finish."""
+        return self.future.cancel()
+
+
+class WorkerPool:
+    """
+    Shared, bounded thread pool for blocking I/O of all sessions.
+
+    At most `max_workers` jobs run at once and `max_pending` more may wait.
+    When the pool is full, submit() blocks (backpressure) until a job finishes,
+    and raises PoolBusy once `timeout` passes. Each session may only hold
+    `per_session` of the slots. Jobs run in a copy of the submitter's context,
+    so request tags and instrumentation spans carry over.
+    """
+
+    def __init__(self, max_workers=WORKER_POOL_SIZE, max_pending=WORKER_QUEUE_SIZE,
+                 per_session=WORKER_SESSION_LIMIT):
+        self.max_workers = max_workers
+        self.capacity = max_workers + max_pending
+        self.per_session = per_session
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="worker")
+        self._cond = threading.Condition()
+        self._jobs = {}  # job id -> Job, queued or running
+        self._sessions = Counter()  # session -> jobs queued or running
+        self._running = 0
+        self._rejected = 0
+        self._ids = itertools.count(1)
+
+    def _has_room(self, session):
+        return len(self._jobs) < self.capacity and self._sessions[session] < self.per_session
+
+    def submit(self, func, *args, session="default", timeout=SUBMIT_TIMEOUT, **kwargs):
+        """
+        Queue `func(*args, **kwargs)` and return its Job right away.
+
+        Raises:
+            PoolBusy: No room for this session within `timeout` seconds.
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._has_room(session), timeout=timeout):
+                self._rejected += 1
+                raise PoolBusy(f"Worker pool busy ({len(self._jobs)} jobs queued or running)")
+            job_id = next(self._ids)
+            self._sessions[session] += 1
+            future = self._executor.submit(contextvars.copy_context().run, self._run, func, args, kwargs)
+            job = self._jobs[job_id] = Job(job_id, session, future)
+        future.add_done_callback(lambda _: self._release(job))
+        return job
+
+    def _run(self, func, args, kwargs):
+        with self._cond:
+            self._running += 1
+        try:
+            return func(*args, **kwargs)
+        finally:
+            with self._cond:
+                self._running -= 1
+
+    def _release(self, job):
+        with self._cond:
+            if self._jobs.pop(job.id, None) is not None:
+                self._sessions[job.session] -= 1
+                if not self._sessions[job.session]:
+                    del self._sessions[job.session]
+            self._cond.notify_all()
+
+    def iterate(self, func, *args, session="default", timeout=SUBMIT_TIMEOUT, **kwargs):
+        """
+        Run the generator `func(*args, **kwargs)` in the pool and yield its items here.
+
+        The worker can run at most STREAM_BUFFER items ahead of the consumer.
+        If the consumer stops early, the worker stops at its next item.
+        Exceptions raised by the generator are re-raised in the consumer.
+        """
+        items = queue.Queue(maxsize=STREAM_BUFFER)
+        stopped = threading.Event()
+
+        def put(entry):
+            """Hand an entry to the consumer; False once the consumer has gone away."""
+            while not stopped.is_set():
+                try:
+                    items.put(entry, timeout=0.5)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def produce():
+            try:
+                for item in func(*args, **kwargs):
+                    if not put((item, None)):
+                        return
+                put((_DONE, None))
+            except BaseException as e:
+                put((_DONE, e))
+
+        job = self.submit(produce, session=session, timeout=timeout)
+        try:
+            while True:
+                item, error = items.get()
+                if item is _DONE:
+                    if error is not None:
+                        raise error
+                    return
+                yield item
+        finally:
+            stopped.set()
+            job.cancel()
+
+    def cancel_session(self, session):
+        """Cancel every job of `session` that has not started yet; returns how many were cancelled."""
+        with self._cond:
+            jobs = [job for job in self._jobs.values() if job.session == session]
+        return sum(job.cancel() for job in jobs)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "workers": self.max_workers,
+                "running": self._running,
+                "queued": len(self._jobs) - self._running,
+                "rejected": self._rejected,
+                "sessions": dict(self._sessions),
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_worker_pool():
+    """Return the process-wide worker pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = WorkerPool()
+    return _pool